@@ -0,0 +1,184 @@
+"""
+time stopsignalmetrics on simulated data, writing the results as JSON
+
+usage: python benchmarks/run_benchmarks.py --subjects 1 10 100 1000 \
+           --output results.json
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+import stopsignalmetrics
+from stopsignalmetrics import StopData, SSRTmodel, Sequence, PostStopSlow,\
+    Violations, StopSummary
+from stopsignalmetrics.simulate import simulate_race
+
+# raw column names, as StopData would be given them
+RAW_VAR_DICT = {
+    'columns': {
+        'ID': 'Subject',
+        'block': 'Block',
+        'condition': 'TrialType',
+        'SSD': 'StopSignalDelay',
+        'goRT': 'GoRT',
+        'stopRT': 'StopFailureRT',
+        'response': 'Response',
+        'correct_response': 'CorrectResponse',
+        'choice_accuracy': 'ChoiceAccuracy',
+    },
+}
+
+LEVELS = ['individual', 'group']
+
+
+def get_cases(data_df, raw_df, level):
+    """Get (name, function) pairs to time at one level."""
+    cases = [
+        ('SSRTmodel', lambda: SSRTmodel().fit(data_df, level=level)),
+        ('SSRTmodel_all',
+         lambda: SSRTmodel(model='all').fit(data_df, level=level)),
+        ('PostStopSlow', lambda: PostStopSlow().fit(data_df, level=level)),
+        ('Violations', lambda: Violations().fit(data_df, level=level)),
+        ('StopSummary', lambda: StopSummary().fit(data_df, level=level)),
+    ]
+    if level == 'group':
+        cases = [
+            ('StopData', lambda: StopData(var_dict=_raw_var_dict())
+             .fit(raw_df)),
+            ('Sequence',
+             lambda: Sequence().fit(data_df, "condition=='stop'")),
+        ] + cases
+    return cases
+
+
+def time_case(func, repeat):
+    """Get the wall times of repeated calls, then the peak memory of one."""
+    wall_times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        wall_times.append(time.perf_counter() - start)
+
+    # traced separately, as tracing slows down the timed runs
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return wall_times, peak
+
+
+def run(subjects, n_trials, levels, repeat, seed, select=None):
+    results = []
+    for n_subjects in subjects:
+        group_df = simulate_race(n_subjects=n_subjects, n_trials=n_trials,
+                                 seed=seed)
+        for level in levels:
+            if level == 'individual':
+                # individual fits do not scale with the group, so time one
+                # subject, once
+                if n_subjects != subjects[0]:
+                    continue
+                data_df = group_df[group_df['ID'] == 1]
+                raw_df = None
+            else:
+                data_df = group_df
+                raw_df = _to_raw(data_df)
+            for name, func in get_cases(data_df, raw_df, level):
+                if select is not None and name not in select:
+                    continue
+                wall_times, peak = time_case(func, repeat)
+                results.append({
+                    'name': name,
+                    'level': level,
+                    'n_subjects': 1 if level == 'individual'
+                    else n_subjects,
+                    'n_trials': n_trials,
+                    'n_rows': len(data_df),
+                    'wall_time_s': min(wall_times),
+                    'wall_times_s': wall_times,
+                    'peak_memory_bytes': peak,
+                })
+                print('{:<14} {:<10} {:>7} subjects {:>9.4f} s {:>9.1f} MB'
+                      .format(name, level, results[-1]['n_subjects'],
+                              min(wall_times), peak / 1024 ** 2),
+                      file=sys.stderr)
+    return results
+
+
+def get_meta(args):
+    return {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'git_revision': _git_revision(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scikit-learn': sklearn.__version__,
+        'args': vars(args),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(stopsignalmetrics.__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _raw_var_dict():
+    return {key: value.copy() for key, value in RAW_VAR_DICT.items()}
+
+
+def _to_raw(data_df):
+    """Undo standardization, so StopData has something to map."""
+    rename = RAW_VAR_DICT['columns']
+    return data_df.drop(columns='choice_accuracy').rename(columns=rename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--subjects', type=int, nargs='+',
+                        default=[1, 10, 100, 1000])
+    parser.add_argument('--trials', type=int, default=400,
+                        help='trials per subject')
+    parser.add_argument('--levels', nargs='+', default=LEVELS,
+                        choices=LEVELS)
+    parser.add_argument('--benchmarks', nargs='+', default=None,
+                        help='names of the benchmarks to run (default all)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='JSON file to write (default stdout)')
+    args = parser.parse_args()
+
+    results = {
+        'meta': get_meta(args),
+        'results': run(sorted(args.subjects), args.trials, args.levels,
+                       args.repeat, args.seed, select=args.benchmarks),
+    }
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(args.output, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,5 +23,6 @@ setuptools.setup(
                               'data/*.csv',
                               ]},
     python_requires='>=3.4',
-    install_requires=['numpy', 'pandas', 'scikit-learn']
+    install_requires=['numpy', 'pandas', 'scikit-learn', 'scipy'],
+    extras_require={'parquet': ['pyarrow']}
 )
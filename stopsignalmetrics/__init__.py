@@ -1,4 +1,7 @@
 from .stopdata import StopData
-from .ssrtmodel import SSRTmodel
-from .sequence import Sequence, PostStopSlow, Violations
-from .stopsummary import StopSummary
\ No newline at end of file
+from .ssrtmodel import SSRTmodel, OnlineSSRTmodel, WindowedSSRTmodel
+from .sequence import Sequence, SequenceView, PostStopSlow, Violations
+from .stopsummary import StopSummary
+from .inhibition import InhibitionFunction
+from .trialtable import TrialTable
+from .trialstore import TrialStore
@@ -0,0 +1,72 @@
+import pandas as pd
+
+# rows per row group; smaller groups let ID filters skip more of a file
+ROW_GROUP_SIZE = 64 * 1024
+
+
+def import_pyarrow():
+    """Import pyarrow, which is only needed for Arrow and Parquet I/O."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('pyarrow is required for Arrow and Parquet I/O; '
+                          'install it with `pip install pyarrow`.')
+    return pyarrow
+
+
+def is_arrow_table(data):
+    """Check for a pyarrow Table without importing pyarrow."""
+    return type(data).__module__.startswith('pyarrow') and \
+        type(data).__name__ == 'Table'
+
+
+def read_parquet(filepath, columns=None, IDs=None, id_column='ID'):
+    """Read a Parquet file into a frame, optionally only some of its
+    columns and subjects.
+
+    Requested columns missing from the file are skipped. The IDs filter
+    is pushed down to the reader, which skips row groups whose ID
+    statistics rule them out, so files sorted by ID are read fastest.
+    """
+    pyarrow = import_pyarrow()
+    if columns is not None:
+        names = pyarrow.parquet.read_schema(filepath).names
+        columns = [col for col in columns if col in names]
+    filters = None
+    if IDs is not None:
+        filters = [(id_column, 'in',
+                    [getattr(sub_id, 'item', lambda: sub_id)()
+                     for sub_id in IDs])]
+    return pyarrow.parquet.read_table(filepath, columns=columns,
+                                      filters=filters).to_pandas()
+
+
+def write_parquet(data_df, filepath, row_group_size=ROW_GROUP_SIZE):
+    """Write a frame to a Parquet file, keeping its index."""
+    pyarrow = import_pyarrow()
+    pyarrow.parquet.write_table(pyarrow.Table.from_pandas(data_df),
+                                filepath, row_group_size=row_group_size)
+
+
+def output_to_frame(output):
+    """Get a computer's output as a frame.
+
+    Dicts of an individual's metrics become one row, with nested dicts
+    flattened as in group output (e.g. 'SSRT_mean' for model='all').
+    """
+    if isinstance(output, pd.DataFrame):
+        return output
+    if isinstance(output, pd.Series):
+        return output.to_frame()
+    if isinstance(output, dict):
+        flat = {}
+        for key, value in output.items():
+            if isinstance(value, dict):
+                for sub_key, sub_value in value.items():
+                    flat['{}_{}'.format(key, sub_key)] = sub_value
+            else:
+                flat[key] = value
+        return pd.DataFrame([flat], columns=list(flat.keys()))
+    # e.g. a SequenceView
+    return output.to_frame()
@@ -1,24 +1,39 @@
 import pandas as pd
 import numpy as np
-import json
-from sklearn.exceptions import NotFittedError
-import pkg_resources
-
-STANDARDS_FILE = pkg_resources.resource_filename(
-    'stopsignalmetrics', 'data/standards.json')
-
-JSON_DICT = {}
-CSV_DICT = {}
-for source in ['mturk', 'inlab']:
-    JSON_DICT[source] = pkg_resources.resource_filename(
-                'stopsignalmetrics',
-                'data/{}.json'.format(source))
-    CSV_DICT[source] = {
-        level: pkg_resources.resource_filename(
-            'stopsignalmetrics', 'data/{}_{}.csv'.format(source, level)
-        )
-        for level in ['group', 'individual']
-    }
+import multiprocessing
+import os
+import weakref
+from .trialtable import TrialTable
+from .trialstore import TrialStore
+from .arrowio import import_pyarrow, is_arrow_table, write_parquet,\
+    output_to_frame
+from .profiling import FitProfile, NULL_STAGE
+from .standards import SOURCES, LEVELS, get_standards, resource_path,\
+    var_dict_path, data_path
+
+STANDARDS_FILE = resource_path('standards.json')
+
+JSON_DICT = {source: var_dict_path(source) for source in SOURCES}
+CSV_DICT = {source: {level: data_path(source, level) for level in LEVELS}
+            for source in SOURCES}
+
+# rows of a TrialStore read at once by a group fit in one process
+STORE_SHARD_ROWS = 1 << 20
+
+
+def not_fitted_error(message):
+    """Get a NotFittedError, importing scikit-learn only when one is
+    raised, as it is slow to import."""
+    from sklearn.exceptions import NotFittedError
+    return NotFittedError(message)
+
+
+def n_processes(n_jobs):
+    """Get the number of processes to use for n_jobs, where None or
+    n_jobs < 1 means one per CPU."""
+    if n_jobs is None or n_jobs < 1:
+        return os.cpu_count()
+    return n_jobs
 
 
 class Computer:
@@ -26,35 +41,123 @@ class Computer:
     def __init__(self):
         self._raw_data = None
         self._transformed_data = None
-        standards = self._load_json()
+        # shared, read-only standards; no file is read here
+        standards = get_standards()
         self._cols = standards['columns']
         self._codes = standards['key_codes']
+        self._profile = None
+        self._zero_copy = False
 
     def fit(self, data_df):
-        return self._is_preprocessed(data_df)
+        self._start_profile()
+        return self._is_preprocessed(self._as_frame(data_df))
 
     def transform(self):
         try:
-            assert self._raw_data is not None
+            assert self._transformed_data is not None
         except AssertionError:
-            raise NotFittedError('Data must first be loaded using .fit()')
+            raise not_fitted_error('Data must first be loaded using .fit()')
         return(self._transformed_data)
 
     def fit_transform(self, data_df):
         self.fit(data_df)
         return(self._transformed_data)
 
+    def to_arrow(self):
+        """Get the transformed data as a pyarrow Table."""
+        return import_pyarrow().Table.from_pandas(
+            output_to_frame(self.transform()))
+
+    def to_parquet(self, filepath, **kwargs):
+        """Write the transformed data to a Parquet file."""
+        write_parquet(output_to_frame(self.transform()), filepath, **kwargs)
+
+    def enable_profiling(self, enabled=True):
+        """Record the wall time, rows and bytes copied by each stage of
+        each fit. Profiling is off by default."""
+        self._profile = FitProfile() if enabled else None
+        return self
+
+    def get_profile(self):
+        """Get a dataframe describing each stage of the last fit."""
+        assert self._profile is not None,\
+            'profiling must first be enabled using .enable_profiling()'
+        return self._profile.report()
+
+    def enable_zero_copy(self, enabled=True):
+        """Treat data passed to fit as read-only: it is never copied, and
+        only the outputs and derived arrays are kept after fitting."""
+        self._zero_copy = enabled
+        return self
+
+    def _release(self):
+        """Drop the reference to the fitted frame in zero-copy mode."""
+        if self._zero_copy:
+            self._raw_data = None
+
+    def _start_profile(self):
+        """Clear the profile at the start of a fit."""
+        if self._profile is not None:
+            self._profile.clear()
+
+    def _stage(self, name, rows=0, nbytes=0):
+        """Context manager timing a stage of a fit, when profiling."""
+        if self._profile is None:
+            return NULL_STAGE
+        return self._profile.stage(name, rows=rows, nbytes=nbytes)
+
+    def _copy(self, data_df):
+        """Copy a frame, recording the bytes copied when profiling.
+
+        In zero-copy mode, the frame itself is returned and must not be
+        modified.
+        """
+        if self._zero_copy:
+            return data_df
+        if self._profile is None:
+            return data_df.copy()
+        with self._stage('copy', rows=len(data_df),
+                         nbytes=int(data_df.memory_usage(index=True).sum())):
+            return data_df.copy()
+
+    def _as_frame(self, data_df):
+        """Unwrap a TrialTable to its frame of standard columns, or read
+        a TrialStore into a frame of memory-mapped columns, or an Arrow
+        table into a frame."""
+        if isinstance(data_df, TrialTable):
+            return data_df.data
+        if isinstance(data_df, TrialStore):
+            return data_df.to_frame()
+        if is_arrow_table(data_df):
+            return data_df.to_pandas()
+        return data_df
+
     def _is_preprocessed(self, data_df):
-        """check that dataset matches standard."""
+        """check that dataset matches standard.
+
+        Frames that already passed are not checked again, as long as their
+        columns, length and accuracy column are unchanged; the lookup is
+        timed in the validate stage, with no rows.
+        """
         assert isinstance(data_df, pd.core.frame.DataFrame),\
             'data must be in the form of a pandas dataframe.'
+        with self._stage('validate') as stage:
+            if not _is_validated(data_df):
+                stage.add_rows(len(data_df))
+                self._check_standard(data_df)
+                _mark_validated(data_df)
+        return True
+
+    def _check_standard(self, data_df):
+        """Assert that the columns and accuracy codes match the standard."""
         missable_columns = [
             'ID', 'response', 'correct_response', 'choice_accuracy'
             ]
-        for key in [key for key in self._cols.keys() if \
-            key not in missable_columns]:
-            assert self._cols[key] in data_df.columns, \
-                'missing {} from data df columns'.format(self._cols[key])
+        missing = [self._cols[key] for key in self._cols.keys()
+                   if key not in missable_columns and
+                   self._cols[key] not in data_df.columns]
+        assert not missing, \
+            'missing {} from data df columns'.format(missing[0])
 
         # condition_codes = data_df[self._cols['condition']].unique()
         # for cond in ['go', 'stop']:
@@ -62,23 +165,17 @@ class Computer:
         #         'missing {} from column: {}.'.format(
         #         self._cols[cond], self._cols["condition"])
 
-        # check that all unique non-nan values in the accuracy column 
+        # check that all non-nan values in the accuracy column
         # can be mapped onto the standard codes for correct or incorrect.
         if 'choice_accuracy' in data_df.columns:
-            acc_codes = data_df[self._cols['choice_accuracy']].unique()
-            acc_codes = [i for i in acc_codes if i==i]
-            standard_acc_codes = [self._codes['correct'], self._codes['incorrect']]
-            for acc_code in acc_codes:
-                assert acc_code in standard_acc_codes,\
-                    '{} present in {} column.'. format(
-                        acc_code, self._cols["choice_accuracy"]
-                    )
-
-        return True
-
-    def _load_json(self, filepath=STANDARDS_FILE):
-        with open(filepath) as json_file:
-            return json.load(json_file)
+            acc = data_df[self._cols['choice_accuracy']]
+            invalid = ~(acc.isin([self._codes['correct'],
+                                  self._codes['incorrect']]) |
+                        acc.isnull())
+            assert not invalid.any(),\
+                '{} present in {} column.'. format(
+                    acc[invalid].iloc[0], self._cols["choice_accuracy"]
+                )
 
     # def _replace_none(self, any_dict):
     #     for k, v in any_dict.items():
@@ -88,23 +185,84 @@ class Computer:
     #             self._replace_none(v)
 
 
+# frames that passed Computer._is_preprocessed, by id, with a weak
+# reference to the frame and a fingerprint of what was checked
+_VALIDATED = {}
+
+
+def _validation_fingerprint(data_df):
+    """Get the columns, number of rows and the memory address of the
+    accuracy column, or None if that column has no fixed buffer.
+
+    This is O(1): replacing the accuracy column, or writing a value that
+    changes its dtype, is detected, but same-dtype in-place writes are
+    not, so code writing accuracy codes calls _forget_validated.
+    """
+    acc_address = None
+    if 'choice_accuracy' in data_df.columns:
+        acc = data_df['choice_accuracy'].values
+        if not isinstance(acc, np.ndarray):
+            return None
+        acc_address = acc.__array_interface__['data'][0]
+    return (tuple(data_df.columns), len(data_df), acc_address)
+
+
+def _mark_validated(data_df):
+    fingerprint = _validation_fingerprint(data_df)
+    if fingerprint is None:
+        return
+    key = id(data_df)
+    try:
+        ref = weakref.ref(data_df, lambda _: _VALIDATED.pop(key, None))
+    except TypeError:
+        return
+    _VALIDATED[key] = (ref, fingerprint)
+
+
+def _forget_validated(data_df):
+    """Check a frame again the next time it is fit, e.g. after writing
+    to its accuracy column in place."""
+    _VALIDATED.pop(id(data_df), None)
+
+
+def _is_validated(data_df):
+    entry = _VALIDATED.get(id(data_df))
+    if entry is None or entry[0]() is not data_df:
+        return False
+    return entry[1] == _validation_fingerprint(data_df)
+
+
 class MultiLevelComputer(Computer):
     """Parent class for computing metrics at individual or group level."""
     def __init__(self):
         super().__init__()
 
-    def fit(self, data_df, level='individual', **kwargs):
+    def fit(self, data_df, level='individual', n_jobs=1, **kwargs):
         assert level in ['individual', 'group']
         self._level = level
-        fit_dict = {
-            'individual': self._fit_individual,
-            'group': self._fit_group
-        }
-        fit_dict[self._level](data_df, **kwargs)
+        # group fits read a store in shards, never as one frame
+        if not (self._level == 'group' and isinstance(data_df, TrialStore)):
+            data_df = self._as_frame(data_df)
+        self._start_profile()
+        with self._stage('fit', rows=len(data_df)):
+            if isinstance(data_df, TrialStore):
+                self._fit_group_store(data_df, n_jobs, **kwargs)
+            elif self._level == 'group' and n_jobs != 1:
+                self._fit_group_parallel(data_df, n_jobs, **kwargs)
+            else:
+                fit_dict = {
+                    'individual': self._fit_individual,
+                    'group': self._fit_group
+                }
+                fit_dict[self._level](data_df, **kwargs)
+            if self._zero_copy:
+                self._keep_derived(data_df)
+                self._release()
         return self
 
-    def fit_transform(self, data_df, level='individual', **kwargs):
-        self.fit(data_df, level=level, **kwargs)
+    def fit_transform(self, data_df, level='individual', n_jobs=1,
+                      **kwargs):
+        self.fit(data_df, level=level, n_jobs=n_jobs, **kwargs)
         return self._transformed_data
 
     def _fit_individual(self, data_df, **kwargs):
@@ -112,3 +270,131 @@ class MultiLevelComputer(Computer):
 
     def _fit_group(self, data_df, **kwargs):
         return self._is_preproccessed(data_df)
+
+    def _fit_group_parallel(self, data_df, n_jobs, **kwargs):
+        """Fit contiguous shards of subjects in a pool of processes.
+
+        Workers receive the data once, when they start, and are then sent
+        only the row range of each shard.
+        """
+        assert self._is_preprocessed(data_df)
+        n_jobs = n_processes(n_jobs)
+        kwargs = self._get_group_kwargs(data_df, **kwargs)
+
+        # sort rows by subject, dropping rows without an ID
+        codes = pd.factorize(data_df['ID'], sort=True)[0]
+        if np.all(codes[1:] >= codes[:-1]) and np.all(codes >= 0):
+            order = None
+        else:
+            order = np.argsort(codes, kind='stable')
+            order = order[codes[order] >= 0]
+            codes = codes[order]
+        results = self._fit_shards(data_df, order,
+                                   _shard_bounds(codes, 4 * n_jobs),
+                                   n_jobs, kwargs)
+        self._raw_data = data_df
+        with self._stage('combine'):
+            self._transformed_data = self._combine_group_shards(results)
+
+    def _fit_group_store(self, store, n_jobs, **kwargs):
+        """Fit a TrialStore in shards of whole subjects, each read as a
+        slice of the store and validated on its own.
+
+        Shards are fit in turn, with only one read at a time, or by a
+        pool of processes that each memory-map the store.
+        """
+        assert isinstance(store, TrialStore)
+        n_jobs = n_processes(n_jobs)
+        kwargs = self._get_group_kwargs(store, **kwargs)
+        codes = store.subject_codes()
+        n_shards = max(4 * n_jobs if n_jobs > 1 else 1,
+                       -(-len(codes) // STORE_SHARD_ROWS))
+        results = self._fit_shards(store, None,
+                                   _shard_bounds(codes, n_shards),
+                                   n_jobs, kwargs)
+        self._raw_data = store
+        with self._stage('combine'):
+            self._transformed_data = self._combine_group_shards(results)
+
+    def _fit_shards(self, data, order, bounds, n_jobs, kwargs):
+        """Fit each (start, stop) shard of a frame or store, in this
+        process or a pool, returning the shard outputs in order."""
+        with self._stage('shards', rows=bounds[-1][1] if bounds else 0):
+            if n_jobs == 1:
+                return [self._fit_group_shard(
+                    _read_shard(data, order, shard_bounds), **kwargs)
+                    for shard_bounds in bounds]
+            with multiprocessing.Pool(n_jobs, initializer=_init_shard_worker,
+                                      initargs=(self, data, order,
+                                                kwargs)) as pool:
+                results = pool.map(_fit_shard, bounds)
+        if self._profile is not None:
+            # fold each worker's stages into this profile
+            results, shard_records = zip(*results)
+            for records in shard_records:
+                self._profile.merge(records)
+        return results
+
+    def _keep_derived(self, data_df):
+        """Keep anything derived from the data that is needed after fit,
+        before the data is released in zero-copy mode."""
+        pass
+
+    def _get_group_kwargs(self, data_df, **kwargs):
+        """Add any group-wide values that every shard needs, from a frame
+        or from the columns of a TrialStore."""
+        return kwargs
+
+    def _fit_group_shard(self, data_df, **kwargs):
+        """Fit one shard of subjects, returning its output."""
+        self._fit_group(data_df, **kwargs)
+        return self._transformed_data
+
+    def _combine_group_shards(self, results):
+        """Combine the outputs of all shards, in subject order."""
+        return pd.concat(results)
+
+
+_SHARD_WORKER = {}
+
+
+def _init_shard_worker(computer, data_df, order, kwargs):
+    _SHARD_WORKER.update(computer=computer, data_df=data_df, order=order,
+                         kwargs=kwargs)
+
+
+def _fit_shard(bounds):
+    data_df = _SHARD_WORKER['data_df']
+    shard_df = _read_shard(data_df, _SHARD_WORKER['order'], bounds)
+    computer = _SHARD_WORKER['computer']
+    if not isinstance(data_df, TrialStore):
+        # shards are rows of a frame validated by the parent
+        _mark_validated(shard_df)
+    if computer._profile is None:
+        return computer._fit_group_shard(shard_df, **_SHARD_WORKER['kwargs'])
+    computer._profile.clear()
+    out = computer._fit_group_shard(shard_df, **_SHARD_WORKER['kwargs'])
+    return out, computer._profile.to_records()
+
+
+def _read_shard(data_df, order, bounds):
+    """Get the rows of a shard from a frame, in subject order, or from a
+    store."""
+    start, stop = bounds
+    if isinstance(data_df, TrialStore):
+        return data_df.read(slice(start, stop))
+    if order is None:
+        return data_df.iloc[start:stop]
+    return data_df.iloc[order[start:stop]]
+
+
+def _shard_bounds(codes, n_shards):
+    """Split sorted subject codes into row ranges of whole subjects."""
+    n_rows = len(codes)
+    subject_starts = np.flatnonzero(
+        np.concatenate(([True], codes[1:] != codes[:-1])))
+    targets = np.linspace(0, n_rows, n_shards + 1)[1:-1]
+    cuts = subject_starts[np.minimum(
+        np.searchsorted(subject_starts, targets), len(subject_starts) - 1)]
+    bounds = np.unique(np.concatenate(([0], cuts, [n_rows])))
+    return list(zip(bounds[:-1], bounds[1:]))
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'stopsignalmetrics')
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+META_FILE = 'meta.json'
+
+
+def write_columns(data_df, path):
+    """Write each column of a frame to its own .npy file in path.
+
+    Numeric and boolean columns are stored as-is so they can be
+    memory-mapped; other columns are stored as integer codes plus
+    their unique values.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    columns = []
+    for i, col in enumerate(data_df.columns):
+        values = data_df[col].values
+        fname = 'col{}'.format(i)
+        if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+            np.save(os.path.join(path, fname + '.npy'), values)
+            columns.append({'name': col, 'file': fname, 'kind': 'array'})
+        else:
+            codes, uniques = pd.factorize(values)
+            np.save(os.path.join(path, fname + '.npy'),
+                    codes.astype(np.int32))
+            np.save(os.path.join(path, fname + '_uniques.npy'),
+                    np.asarray(uniques, dtype=object), allow_pickle=True)
+            columns.append({'name': col, 'file': fname, 'kind': 'codes'})
+    return {'columns': columns, 'n_rows': len(data_df)}
+
+
+def read_columns(path, meta, mmap=True, rows=None, columns=None):
+    """Read columns written by write_columns back into a frame.
+
+    With mmap=True, numeric columns are copy-on-write memory maps.
+    rows may be a slice of rows to read.
+    """
+    data_dict = {}
+    for name, (values, uniques) in open_columns(path, meta, mmap=mmap,
+                                                columns=columns).items():
+        if rows is not None:
+            values = values[rows]
+        data_dict[name] = decode_column(values, uniques)
+    return pd.DataFrame(data_dict, columns=list(data_dict.keys()),
+                        copy=False)
+
+
+def open_columns(path, meta, mmap=True, columns=None):
+    """Open columns written by write_columns without decoding them.
+
+    Returns (values, uniques) by column name, where uniques is None for
+    numeric columns and values are integer codes otherwise.
+    """
+    mmap_mode = 'c' if mmap else None
+    opened = OrderedDict()
+    for col_info in meta['columns']:
+        if columns is not None and col_info['name'] not in columns:
+            continue
+        values = np.load(os.path.join(path, col_info['file'] + '.npy'),
+                         mmap_mode=mmap_mode)
+        uniques = None
+        if col_info['kind'] == 'codes':
+            uniques = np.load(
+                os.path.join(path, col_info['file'] + '_uniques.npy'),
+                allow_pickle=True)
+        opened[col_info['name']] = (values, uniques)
+    return opened
+
+
+def decode_column(values, uniques):
+    """Map codes from open_columns back to values, with -1 as NaN."""
+    if uniques is None:
+        return values
+    codes = np.asarray(values)
+    return np.append(uniques, np.nan)[
+        np.where(codes < 0, len(uniques), codes)]
+
+
+def file_fingerprint(filepath):
+    """Identify a file by its path, size and modification time."""
+    stat = os.stat(filepath)
+    return {'path': os.path.abspath(filepath),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+
+def make_key(*parts):
+    """Hash JSON-serializable parts into a cache key."""
+    key_str = json.dumps([CACHE_VERSION] + list(parts), sort_keys=True,
+                         default=str)
+    return hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+
+
+class DataCache:
+    """Size-bounded on-disk cache of frames, evicting the least recently
+    used entries first."""
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = DEFAULT_CACHE_DIR if cache_dir is None \
+            else cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get(self, key, mmap=True):
+        """Get a cached frame, or None if it is not cached."""
+        path = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.isfile(meta_path):
+            return None
+        with open(meta_path) as json_file:
+            meta = json.load(json_file)
+        # mark as recently used
+        os.utime(meta_path, None)
+        return read_columns(path, meta, mmap=mmap)
+
+    def put(self, key, data_df):
+        """Cache a frame, then evict entries beyond the size bound."""
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp')
+        try:
+            meta = write_columns(data_df, tmp_path)
+            with open(os.path.join(tmp_path, META_FILE), 'w') as json_file:
+                json.dump(meta, json_file)
+            path = os.path.join(self.cache_dir, key)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.rename(tmp_path, path)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until under max_bytes."""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, key, META_FILE)
+            if not os.path.isfile(meta_path):
+                continue
+            entries.append((os.path.getmtime(meta_path), key,
+                            _dir_size(os.path.join(self.cache_dir, key))))
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key),
+                          ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove every cached entry."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir)
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, fname))
+               for fname in os.listdir(path))
@@ -0,0 +1,315 @@
+import warnings
+import numpy as np
+import pandas as pd
+from scipy.special import log_ndtr
+
+# subjects optimized together, quadrature nodes per SSRT component, and
+# optimizer settings
+BATCH_SIZE = 64
+N_NODES = 12
+MAX_ITER = 500
+TOL = 1e-10
+MAX_HALVINGS = 30
+PARAMS = ['go_mu', 'go_sigma', 'go_tau', 'stop_mu', 'stop_sigma', 'stop_tau']
+COLUMNS = ['SSRT', 'SSRT_sd'] + PARAMS + ['neg_log_likelihood']
+
+_LOG_SQRT_2PI = .5 * np.log(2 * np.pi)
+
+
+def exgauss_logpdf(t, mu, sigma, tau, grad=False):
+    """Log density of the ex-Gaussian distribution.
+
+    With grad=True, also returns its gradient with respect to
+    (mu, log sigma, log tau), stacked on a new last axis.
+    """
+    A = (mu - t) / tau + sigma ** 2 / (2 * tau ** 2)
+    z = (t - mu) / sigma - sigma / tau
+    log_cdf_z = log_ndtr(z)
+    logpdf = A + log_cdf_z - np.log(tau)
+    if not grad:
+        return logpdf
+    mills = np.exp(-z ** 2 / 2 - _LOG_SQRT_2PI - log_cdf_z)
+    return logpdf, np.stack([
+        1 / tau - mills / sigma,
+        sigma ** 2 / tau ** 2 - mills * ((t - mu) / sigma + sigma / tau),
+        (t - mu) / tau - sigma ** 2 / tau ** 2 + mills * sigma / tau - 1,
+    ], axis=-1)
+
+
+def exgauss_logsf(t, mu, sigma, tau, grad=False):
+    """Log survival function of the ex-Gaussian distribution, with its
+    gradient as in exgauss_logpdf when grad=True."""
+    u = (t - mu) / sigma
+    A = (mu - t) / tau + sigma ** 2 / (2 * tau ** 2)
+    z = u - sigma / tau
+    log_sf_u = log_ndtr(-u)
+    log_cdf_z = log_ndtr(z)
+    # S(t) = 1 - Phi(u) + exp(A) Phi(z), summed in log space
+    logsf = np.logaddexp(log_sf_u, A + log_cdf_z)
+    if not grad:
+        return logsf
+    normal_weight = np.exp(log_sf_u - logsf)
+    exp_weight = np.exp(A + log_cdf_z - logsf)
+    hazard = np.exp(-u ** 2 / 2 - _LOG_SQRT_2PI - log_sf_u)
+    mills = np.exp(-z ** 2 / 2 - _LOG_SQRT_2PI - log_cdf_z)
+    return logsf, np.stack([
+        normal_weight * hazard / sigma +
+        exp_weight * (1 / tau - mills / sigma),
+        normal_weight * hazard * u +
+        exp_weight * (sigma ** 2 / tau ** 2 -
+                      mills * ((t - mu) / sigma + sigma / tau)),
+        exp_weight * ((t - mu) / tau - sigma ** 2 / tau ** 2 +
+                      mills * sigma / tau),
+    ], axis=-1)
+
+
+def fit_race(trials, start_SSRTs, batch_size=BATCH_SIZE, n_nodes=N_NODES):
+    """Fit ex-Gaussian go and stop distributions of the race model to each
+    subject of a TrialArrays by maximum likelihood.
+
+    Go RTs are ex-Gaussian, as are SSRTs, and stop trials respond when
+    the go process finishes first; go omissions are left out. Subjects
+    are fit in batches, with the likelihood of every subject in a batch
+    evaluated at once and its analytic gradient driving a BFGS step per
+    subject, starting from start_SSRTs (e.g. the integration method's).
+    Subjects with a NaN start are not fit. Returns a dataframe indexed
+    by subject position, with the mean and sd of each SSRT distribution,
+    its parameters and the likelihood.
+    """
+    out = np.full((trials.groups.n_groups, len(COLUMNS)), np.nan)
+    subjects = []
+    for i, rows in enumerate(trials.subject_slices()):
+        if np.isnan(start_SSRTs[i]):
+            continue
+        is_stop = trials.is_stop[rows] & ~np.isnan(trials.SSD[rows])
+        subjects.append((i, trials.goRT[rows][trials.go_resp[rows]],
+                         trials.SSD[rows][is_stop],
+                         trials.stopRT[rows][is_stop], start_SSRTs[i]))
+    for start in range(0, len(subjects), batch_size):
+        batch = subjects[start:start + batch_size]
+        positions = [subject[0] for subject in batch]
+        out[positions] = _fit_batch(batch, n_nodes)
+    return pd.DataFrame(out, columns=COLUMNS)
+
+
+def _fit_batch(subjects, n_nodes):
+    """Fit a batch of subjects, returning a row of COLUMNS for each."""
+    batch = _RaceBatch([subject[1:4] for subject in subjects], n_nodes)
+    x0 = np.array([_start_params(subject[1], subject[4])
+                   for subject in subjects])
+    theta, nll, converged = _minimize_batch(
+        batch.neg_log_likelihood, batch.to_internal(x0),
+        batch.lower, batch.upper)
+    if not converged.all():
+        warnings.warn('ex-Gaussian fit did not converge for {} of {} '
+                      'subjects'.format((~converged).sum(), len(subjects)))
+    params = batch.to_params(theta)
+    return np.column_stack([
+        params[:, 3] + params[:, 5],
+        np.sqrt(params[:, 4] ** 2 + params[:, 5] ** 2),
+        params, nll])
+
+
+def _start_params(goRTs, start_SSRT):
+    """Moment estimates of the go parameters, and stop parameters with
+    the start SSRT as their mean."""
+    mean, sd = goRTs.mean(), goRTs.std()
+    skew = ((goRTs - mean) ** 3).mean() / sd ** 3 if sd > 0 else 0
+    go_tau = np.clip(sd * np.cbrt(max(skew, 0) / 2), .1 * sd, .9 * sd)
+    go_sigma = np.sqrt(sd ** 2 - go_tau ** 2)
+    SSRT = max(start_SSRT, .1 * mean)
+    stop_tau = stop_sigma = .1 * SSRT
+    return np.array([mean - go_tau, go_sigma, go_tau,
+                     SSRT - stop_tau, stop_sigma, stop_tau])
+
+
+def _minimize_batch(fun, x0, lower, upper, max_iter=MAX_ITER, tol=TOL):
+    """Minimize an independent function per row of x0 with BFGS, taking
+    one step for every unconverged row at a time.
+
+    fun(x, rows) returns the value and gradient for those rows. Steps
+    are halved until they decrease the value enough (Armijo), and
+    clipped to the bounds of each row, lower and upper. A row has
+    converged when its step no longer changes the value by more than
+    tol, relatively. Returns x, the values and which rows converged.
+    """
+    n_rows, n_params = x0.shape
+    x = np.clip(x0, lower, upper)
+    f, g = fun(x, np.arange(n_rows))
+    H = np.tile(np.eye(n_params), (n_rows, 1, 1))
+    active = np.isfinite(f)
+    converged = np.zeros(n_rows, dtype=bool)
+    for _ in range(max_iter):
+        rows = np.flatnonzero(active)
+        if not len(rows):
+            break
+        direction = -np.einsum('nij,nj->ni', H[rows], g[rows])
+        # fall back to steepest descent when BFGS does not descend
+        uphill = (direction * g[rows]).sum(axis=1) >= 0
+        H[rows[uphill]] = np.eye(n_params)
+        direction[uphill] = -g[rows[uphill]]
+
+        step = np.ones(len(rows))
+        pending = np.ones(len(rows), dtype=bool)
+        new_x, new_f, new_g = x[rows].copy(), f[rows].copy(), g[rows].copy()
+        for _ in range(MAX_HALVINGS):
+            idx = np.flatnonzero(pending)
+            trial_x = np.clip(x[rows[idx]] + step[idx, None] *
+                              direction[idx], lower[rows[idx]],
+                              upper[rows[idx]])
+            trial_f, trial_g = fun(trial_x, rows[idx])
+            decrease = ((trial_x - x[rows[idx]]) * g[rows[idx]]).sum(axis=1)
+            accept = np.isfinite(trial_f) & \
+                (trial_f <= f[rows[idx]] + 1e-4 * decrease)
+            new_x[idx[accept]] = trial_x[accept]
+            new_f[idx[accept]] = trial_f[accept]
+            new_g[idx[accept]] = trial_g[accept]
+            pending[idx[accept]] = False
+            if not pending.any():
+                break
+            step[idx[~accept]] /= 2
+
+        # BFGS update of the inverse Hessians, where curvature allows
+        s = new_x - x[rows]
+        y = new_g - g[rows]
+        sy = (s * y).sum(axis=1)
+        update = sy > 1e-12
+        first = update & (np.abs(H[rows] - np.eye(n_params)).sum(axis=(1, 2))
+                          == 0)
+        H_rows = H[rows]
+        H_rows[first] *= (sy[first] / (y[first] ** 2).sum(axis=1))[:, None,
+                                                                     None]
+        rho = np.where(update, 1 / np.where(update, sy, 1), 0)
+        V = np.eye(n_params) - rho[:, None, None] * s[:, :, None] * \
+            y[:, None, :]
+        H_rows = np.einsum('nij,njk,nlk->nil', V, H_rows, V) + \
+            rho[:, None, None] * s[:, :, None] * s[:, None, :]
+        H[rows] = H_rows
+
+        done = pending | (f[rows] - new_f <=
+                          tol * np.maximum(np.abs(new_f), 1))
+        x[rows], f[rows], g[rows] = new_x, new_f, new_g
+        converged[rows[done & ~pending]] = True
+        # a step that cannot decrease the value is as far as it goes
+        converged[rows[pending]] = True
+        active[rows[done]] = False
+    return x, f, converged
+
+
+class _RaceBatch:
+    """Padded trial arrays of a batch of subjects, and their likelihood.
+
+    Parameters are optimized as (mu / scale, log sigma, log tau) for the
+    go and then the stop process, with each subject's go RT sd as its
+    scale. Stop successes are grouped by SSD; their probability, the
+    expected go survival at SSD + SSRT, is found with Gauss-Hermite and
+    Gauss-Laguerre nodes for the normal and exponential parts of SSRT.
+    """
+    def __init__(self, subjects, n_nodes):
+        goRTs, SSDs, stopRTs = zip(*subjects)
+        fail = [~np.isnan(RTs) for RTs in stopRTs]
+        self.scale = np.array([max(RTs.std(), 1e-3) for RTs in goRTs])
+        fill = np.mean(np.concatenate(goRTs))
+        self.go_RT, self.go_mask = _pad(goRTs, fill)
+        self.fail_RT, self.fail_mask = _pad(
+            [RTs[is_fail] for RTs, is_fail in zip(stopRTs, fail)], fill)
+        self.fail_SSD, _ = _pad(
+            [SSD[is_fail] for SSD, is_fail in zip(SSDs, fail)], 0.)
+        success_SSDs = [np.unique(SSD[~is_fail], return_counts=True)
+                        for SSD, is_fail in zip(SSDs, fail)]
+        self.success_SSD, _ = _pad([SSD for SSD, _ in success_SSDs], 0.)
+        self.success_count, _ = _pad([counts for _, counts in success_SSDs],
+                                     0.)
+
+        normal_nodes, normal_weights = np.polynomial.hermite_e.hermegauss(
+            n_nodes)
+        exp_nodes, exp_weights = np.polynomial.laguerre.laggauss(n_nodes)
+        self.normal_nodes = np.repeat(normal_nodes, n_nodes)
+        self.exp_nodes = np.tile(exp_nodes, n_nodes)
+        self.log_weights = np.log(
+            np.outer(normal_weights / np.sqrt(2 * np.pi), exp_weights)
+            .ravel())
+
+        # sigmas and taus are kept within a range around the scale
+        lower, upper = np.log(1e-3 * self.scale), np.log(1e2 * self.scale)
+        self.lower = np.column_stack([np.full(len(subjects), -np.inf),
+                                      lower, lower] * 2)
+        self.upper = np.column_stack([np.full(len(subjects), np.inf),
+                                      upper, upper] * 2)
+
+    def to_internal(self, params):
+        theta = np.log(params)
+        theta[:, [0, 3]] = params[:, [0, 3]] / self.scale[:, None]
+        return theta
+
+    def to_params(self, theta, rows=slice(None)):
+        params = np.exp(theta)
+        params[:, [0, 3]] = theta[:, [0, 3]] * self.scale[rows, None]
+        return params
+
+    def neg_log_likelihood(self, theta, rows, grad=True):
+        """Negative log likelihood of some subjects of the batch, and its
+        gradient."""
+        params = self.to_params(theta, rows)
+        go = [params[:, i, None] for i in range(3)]
+        stop = [params[:, i, None] for i in range(3, 6)]
+        go_RT, go_mask = self.go_RT[rows], self.go_mask[rows]
+        fail_RT, fail_mask = self.fail_RT[rows], self.fail_mask[rows]
+        fail_SSD = self.fail_SSD[rows]
+        success_SSD = self.success_SSD[rows]
+        success_count = self.success_count[rows]
+
+        # go responses, and stop failures, where go finished first
+        go_ll, d_go = exgauss_logpdf(go_RT, *go, grad=True)
+        fail_go_ll, d_fail_go = exgauss_logpdf(fail_RT, *go, grad=True)
+        fail_stop_ll, d_fail_stop = exgauss_logsf(fail_RT - fail_SSD, *stop,
+                                                  grad=True)
+        # stop successes, where go had not finished by SSD + SSRT
+        SSRT_nodes = stop[0] + stop[1] * self.normal_nodes + \
+            stop[2] * self.exp_nodes
+        finish = success_SSD[:, :, None] + SSRT_nodes[:, None, :]
+        go_3d = [param[:, :, None] for param in go]
+        node_ll, d_node = exgauss_logsf(finish, *go_3d, grad=True)
+        integrand = node_ll + self.log_weights
+        success_ll = np.logaddexp.reduce(integrand, axis=-1)
+
+        ll = (go_ll * go_mask).sum(axis=1) + \
+            ((fail_go_ll + fail_stop_ll) * fail_mask).sum(axis=1) + \
+            (success_ll * success_count).sum(axis=1)
+        if not grad:
+            return -ll
+        # the gradient of a log sum is the gradient of each term, weighted
+        # by its share of the sum; SSRT parameters move the nodes, where
+        # the log survival changes by minus the go hazard
+        share = np.exp(integrand - success_ll[:, :, None]) * \
+            success_count[:, :, None]
+        hazard_share = share * np.exp(
+            exgauss_logpdf(finish, *go_3d) - node_ll)
+        d_stop_nodes = -np.stack([
+            hazard_share.sum(axis=(1, 2)),
+            (hazard_share * self.normal_nodes).sum(axis=(1, 2)) *
+            stop[1][:, 0],
+            (hazard_share * self.exp_nodes).sum(axis=(1, 2)) *
+            stop[2][:, 0],
+        ], axis=1)
+        d_go_params = (d_go * go_mask[:, :, None]).sum(axis=1) + \
+            (d_fail_go * fail_mask[:, :, None]).sum(axis=1) + \
+            np.einsum('bun,bunk->bk', share, d_node)
+        d_stop_params = \
+            (d_fail_stop * fail_mask[:, :, None]).sum(axis=1) + d_stop_nodes
+        d_theta = np.concatenate([d_go_params, d_stop_params], axis=1)
+        # mu is optimized in units of the subject's scale
+        d_theta[:, [0, 3]] *= self.scale[rows, None]
+        return -ll, -d_theta
+
+
+def _pad(arrays, fill):
+    """Stack arrays of different lengths into a padded 2D array, with a
+    mask of the real values."""
+    width = max(max(len(values) for values in arrays), 1)
+    padded = np.full((len(arrays), width), float(fill))
+    mask = np.zeros((len(arrays), width))
+    for i, values in enumerate(arrays):
+        padded[i, :len(values)] = values
+        mask[i, :len(values)] = 1
+    return padded, mask
@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+
+
+class GroupIndex:
+    """Integer subject codes for grouped NumPy reductions over a frame."""
+    def __init__(self, ids, name='ID'):
+        codes, uniques = pd.factorize(ids, sort=True)
+        self.codes = np.asarray(codes)
+        # plain values, even when the IDs are categorical
+        self.ids = pd.Index(np.asarray(uniques), name=name)
+        self.n_groups = len(uniques)
+        # rows with a missing ID are dropped, as groupby does
+        self._valid = self.codes >= 0
+
+    @classmethod
+    def single(cls, n_rows, name='ID'):
+        """Treat every row as belonging to one subject."""
+        return cls(np.zeros(n_rows, dtype=np.int64), name=name)
+
+    def take(self, order):
+        """Reorder the rows, keeping the same subjects."""
+        out = GroupIndex.__new__(GroupIndex)
+        out.codes = self.codes[order]
+        out.ids = self.ids
+        out.n_groups = self.n_groups
+        out._valid = self._valid[order]
+        return out
+
+    def count(self, mask):
+        """Count the masked rows in each group."""
+        keep = mask & self._valid
+        return np.bincount(self.codes[keep], minlength=self.n_groups)
+
+    def sum(self, values, mask):
+        """Sum the masked values in each group."""
+        keep = mask & self._valid
+        return np.bincount(self.codes[keep], weights=values[keep],
+                           minlength=self.n_groups)
+
+    def mean(self, values, mask):
+        """Mean of the masked values in each group, NaN if empty."""
+        counts = self.count(mask)
+        sums = self.sum(values, mask)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    def std(self, values, mask, ddof=0):
+        """Standard deviation of the masked values in each group."""
+        counts = self.count(mask)
+        means = self.mean(values, mask)
+        keep = mask & self._valid
+        dev = values[keep] - means[self.codes[keep]]
+        ssq = np.bincount(self.codes[keep], weights=dev * dev,
+                          minlength=self.n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > ddof,
+                            np.sqrt(ssq / (counts - ddof)),
+                            np.nan)
+
+    def max(self, values, mask):
+        """Max of the masked values in each group, NaN if empty."""
+        keep = mask & self._valid
+        out = np.full(self.n_groups, -np.inf)
+        np.maximum.at(out, self.codes[keep], values[keep])
+        out[np.isneginf(out)] = np.nan
+        return out
+
+    def sort_within(self, values, mask):
+        """Sort the masked values within each group.
+
+        Returns the sorted values with the start offset and length of each
+        group's run.
+        """
+        keep = mask & self._valid
+        vals = values[keep]
+        codes = self.codes[keep]
+        order = np.lexsort((vals, codes))
+        counts = np.bincount(codes, minlength=self.n_groups)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        return vals[order], starts, counts
+
+
+class TrialArrays:
+    """Condition masks, RT arrays and a neighbor index shared by metrics.
+
+    Rows are stably reordered so that each subject's trials are
+    contiguous; neighbors are the adjacent trials of the same subject.
+    """
+    def __init__(self, data_df, level='group'):
+        assert level in ['individual', 'group']
+        if level == 'group':
+            groups = GroupIndex(data_df['ID'])
+            order = np.argsort(groups.codes, kind='stable')
+            self.groups = groups.take(order)
+            self._match = self.groups.codes
+        else:
+            order = np.arange(len(data_df))
+            self.groups = GroupIndex.single(len(data_df))
+            self._match = pd.factorize(data_df['ID'])[0] \
+                if 'ID' in data_df.columns else self.groups.codes
+        self.order = order
+        self.n_rows = len(order)
+
+        condition = data_df['condition']
+        self.is_go = (condition == 'go').values[order]
+        self.is_stop = (condition == 'stop').values[order]
+        self.goRT = as_float(data_df['goRT'])[order]
+        self.stopRT = as_float(data_df['stopRT'])[order]
+        self.SSD = as_float(data_df['SSD'])[order]
+        self.go_resp = self.is_go & ~np.isnan(self.goRT)
+        self.stop_fail = self.is_stop & ~np.isnan(self.stopRT)
+        if 'choice_accuracy' in data_df.columns:
+            self.acc = as_float(data_df['choice_accuracy'])[order]
+        else:
+            self.acc = None
+        self._block = pd.factorize(data_df['block'])[0][order]
+        self._has_neighbors = None
+
+    def subject_slices(self):
+        """Get the slice of rows belonging to each subject."""
+        subjects = np.arange(self.groups.n_groups)
+        starts = np.searchsorted(self.groups.codes, subjects)
+        stops = np.searchsorted(self.groups.codes, subjects, side='right')
+        return [slice(start, stop) for start, stop in zip(starts, stops)]
+
+    @property
+    def has_neighbors(self):
+        """Mask of trials with a pre and post trial in the same block."""
+        if self._has_neighbors is None:
+            match, block = self._match, self._block
+            has_neighbors = np.zeros(self.n_rows, dtype=bool)
+            has_neighbors[1:-1] = ((match[:-2] >= 0) &
+                                   (match[:-2] == match[2:]) &
+                                   (block[:-2] >= 0) &
+                                   (block[:-2] == block[2:]))
+            self._has_neighbors = has_neighbors
+        return self._has_neighbors
+
+
+def shift(values, offset):
+    """Shift an array so position i holds values[i + offset]."""
+    out = np.empty_like(values)
+    if abs(offset) >= len(values):
+        out[:] = _fill_value(values)
+    elif offset > 0:
+        out[:-offset] = values[offset:]
+        out[-offset:] = _fill_value(values)
+    elif offset < 0:
+        out[-offset:] = values[:offset]
+        out[:-offset] = _fill_value(values)
+    else:
+        out[:] = values
+    return out
+
+
+def _fill_value(values):
+    return False if values.dtype == bool else np.nan
+
+
+def as_float(series):
+    """Return a column as a float64 array, with None mapped to NaN."""
+    return np.asarray(series, dtype=float)
+
+
+def nth_index(p_respond, n_RTs):
+    """Vectorized index of the nth RT, clipped to the available RTs."""
+    with np.errstate(invalid='ignore'):
+        nth = np.rint(p_respond * n_RTs) - 1
+    return np.clip(np.nan_to_num(nth), 0, np.maximum(n_RTs - 1, 0))\
+        .astype(np.int64)
+
+
+def select_nth(values, nths):
+    """Partially sort values so that every position in nths holds its
+    order statistic, in one selection pass."""
+    nths = [nth for nth in set(nths) if nth < len(values)]
+    if not nths:
+        return values
+    return np.partition(values, sorted(nths))
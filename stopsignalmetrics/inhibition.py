@@ -0,0 +1,207 @@
+import warnings
+import numpy as np
+import pandas as pd
+from .base import MultiLevelComputer, not_fitted_error
+from .grouping import TrialArrays
+
+MAX_ITER = 100
+TOL = 1e-10
+CURVE_PARAMS = {
+    'logistic': ['SSD_50', 'slope', 'scale'],
+    'weibull': ['SSD_50', 'slope', 'alpha', 'beta'],
+}
+
+
+class InhibitionFunction(MultiLevelComputer):
+    """P(respond|signal) at each SSD, and a curve fit to it.
+
+    Fitting gives a table of the stop trials, stop failures, P(respond)
+    and mean stop-fail RT at each SSD (see get_table), and a binomial
+    maximum likelihood fit of P(respond) over SSD for each subject. The
+    logistic curve is 1 / (1 + exp(-(SSD - SSD_50) / scale)), and the
+    Weibull curve is 1 - exp(-(SSD / alpha) ** beta), fit to SSDs > 0.
+    SSD_50 is the SSD where the curve crosses .5, and slope is its
+    derivative there.
+    """
+    def __init__(self, model='logistic'):
+        assert model in CURVE_PARAMS.keys()
+        super().__init__()
+        self.model = model
+        self._table = None
+
+    def get_table(self):
+        """Get the stop trials, stop failures, P(respond) and mean
+        stop-fail RT at each SSD, indexed by SSD for an individual or by
+        ID and SSD for a group."""
+        try:
+            assert self._table is not None
+        except AssertionError:
+            raise not_fitted_error('Data must first be fit using .fit()')
+        return self._table
+
+    def _fit_individual(self, data_df):
+        """Get the inhibition function of an individual."""
+        assert self._is_preprocessed(data_df)
+        self._raw_data = data_df
+        with self._stage('trial_arrays', rows=len(data_df)):
+            trials = TrialArrays(data_df, level='individual')
+        curves, table = self._calc_inhibition(trials)
+        self._table = table.reset_index(level='ID', drop=True)
+        self._transformed_data = curves.iloc[0].to_dict()
+
+    def _fit_group(self, data_df):
+        """Get the inhibition function of each subject."""
+        self._transformed_data = self._combine_group_shards(
+            [self._fit_group_shard(data_df)])
+
+    def _fit_group_shard(self, data_df):
+        """Get the curves and table of a shard of subjects."""
+        assert self._is_preprocessed(data_df)
+        self._raw_data = data_df
+        with self._stage('trial_arrays', rows=len(data_df)):
+            trials = TrialArrays(data_df)
+        return self._calc_inhibition(trials)
+
+    def _combine_group_shards(self, results):
+        """Stack the curves and tables of every shard, keeping the table
+        for get_table."""
+        curves, tables = zip(*results)
+        self._table = pd.concat(tables)
+        return pd.concat(curves)
+
+    def _calc_inhibition(self, trials):
+        """Tabulate every subject's SSDs in one grouped pass, then fit the
+        curves of all subjects at once."""
+        with self._stage('table', rows=trials.n_rows):
+            table = _inhibition_table(trials)
+        with self._stage('curves', rows=len(table)):
+            curves = _fit_curves(table, trials.groups.ids, self.model)
+        return curves, table
+
+
+def _inhibition_table(trials):
+    """Count stop trials and failures per subject and SSD."""
+    stop = trials.is_stop & ~np.isnan(trials.SSD) & \
+        (trials.groups.codes >= 0)
+    SSD_codes, SSDs = pd.factorize(trials.SSD[stop], sort=True)
+    # one code per (subject, SSD) pair, in subject then SSD order
+    pairs, pair_codes = np.unique(
+        trials.groups.codes[stop] * len(SSDs) + SSD_codes,
+        return_inverse=True)
+    fail = trials.stop_fail[stop]
+    n_trials = np.bincount(pair_codes, minlength=len(pairs))
+    n_respond = np.bincount(pair_codes, weights=fail, minlength=len(pairs))
+    RT_sums = np.bincount(pair_codes[fail],
+                          weights=trials.stopRT[stop][fail],
+                          minlength=len(pairs))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_RTs = np.where(n_respond > 0, RT_sums / n_respond, np.nan)
+    index = pd.MultiIndex.from_arrays(
+        [trials.groups.ids[pairs // len(SSDs)],
+         np.asarray(SSDs)[pairs % len(SSDs)]],
+        names=['ID', 'SSD'])
+    return pd.DataFrame({'n_trials': n_trials,
+                         'n_respond': n_respond.astype(np.int64),
+                         'p_respond': n_respond / n_trials,
+                         'mean_stopfail_RT': mean_RTs},
+                        index=index)
+
+
+def _fit_curves(table, ids, model):
+    """Fit a curve to every subject's table at once.
+
+    Both curves are binomial GLMs, linear in SSD with a logit link
+    (logistic) or in log SSD with a complementary log-log link
+    (Weibull), and are fit by Fisher scoring, stepping every subject
+    together, on SSDs standardized within each subject.
+    """
+    if model == 'weibull':
+        table = table[table.index.get_level_values('SSD') > 0]
+    codes = ids.get_indexer(table.index.get_level_values('ID'))
+    x = np.asarray(table.index.get_level_values('SSD'), dtype=float)
+    if model == 'weibull':
+        x = np.log(x)
+    n = table['n_trials'].values.astype(float)
+    k = table['n_respond'].values.astype(float)
+
+    # pad each subject's SSDs into a row
+    counts = np.bincount(codes, minlength=len(ids))
+    width = max(counts.max() if len(counts) else 0, 1)
+    positions = np.arange(len(codes)) - \
+        np.concatenate(([0], np.cumsum(counts)[:-1]))[codes]
+    X, N, K = (np.zeros((len(ids), width)) for _ in range(3))
+    X[codes, positions] = x
+    N[codes, positions] = n
+    K[codes, positions] = k
+    has_trials = N > 0
+    center = np.where(counts > 0,
+                      np.bincount(codes, weights=x, minlength=len(ids)) /
+                      np.maximum(counts, 1), 0)
+    spread = np.sqrt(np.bincount(codes, weights=(x - center[codes]) ** 2,
+                                 minlength=len(ids)) / np.maximum(counts, 1))
+    fittable = (counts >= 2) & (spread > 0)
+    Z = np.where(has_trials, (X - center[:, None]) /
+                 np.where(fittable, spread, 1)[:, None], 0)
+
+    coefs = np.zeros((len(ids), 2))
+    active = fittable.copy()
+    converged = np.zeros(len(ids), dtype=bool)
+    for _ in range(MAX_ITER):
+        if not active.any():
+            break
+        rows = np.flatnonzero(active)
+        eta = coefs[rows, :1] + coefs[rows, 1:] * Z[rows]
+        p, dp = _inverse_link(eta, model)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = np.maximum(p * (1 - p), 1e-12)
+            resid = np.where(has_trials[rows],
+                             (K[rows] - N[rows] * p) * dp / var, 0)
+            weight = np.where(has_trials[rows], N[rows] * dp ** 2 / var, 0)
+        score = np.stack([resid.sum(axis=1),
+                          (resid * Z[rows]).sum(axis=1)], axis=1)
+        info = np.stack([
+            weight.sum(axis=1), (weight * Z[rows]).sum(axis=1),
+            (weight * Z[rows] ** 2).sum(axis=1)], axis=1)
+        det = info[:, 0] * info[:, 2] - info[:, 1] ** 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            step = np.stack([info[:, 2] * score[:, 0] -
+                             info[:, 1] * score[:, 1],
+                             info[:, 0] * score[:, 1] -
+                             info[:, 1] * score[:, 0]], axis=1) / \
+                det[:, None]
+        singular = ~np.isfinite(step).all(axis=1)
+        step[singular] = 0
+        coefs[rows] += step
+        done = singular | (np.abs(step).max(axis=1) <
+                           TOL * (1 + np.abs(coefs[rows]).max(axis=1)))
+        converged[rows[done & ~singular]] = True
+        active[rows[done]] = False
+    if (fittable & ~converged).any():
+        warnings.warn('{} curve did not converge for {} subjects'.format(
+            model, (fittable & ~converged).sum()))
+
+    # back to SSDs, from the standardized ones
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope_x = np.where(fittable, coefs[:, 1] / spread, np.nan)
+        intercept = coefs[:, 0] - slope_x * center
+        if model == 'logistic':
+            SSD_50 = -intercept / slope_x
+            params = {'SSD_50': SSD_50, 'slope': slope_x / 4,
+                      'scale': 1 / slope_x}
+        else:
+            # p = .5 where exp(eta) = log(2)
+            SSD_50 = np.exp((np.log(np.log(2)) - intercept) / slope_x)
+            params = {'SSD_50': SSD_50,
+                      'slope': np.log(2) / 2 * slope_x / SSD_50,
+                      'alpha': np.exp(-intercept / slope_x),
+                      'beta': slope_x}
+    return pd.DataFrame(params, index=ids, columns=CURVE_PARAMS[model])
+
+
+def _inverse_link(eta, model):
+    """Get P(respond) and its derivative for a linear predictor."""
+    if model == 'logistic':
+        p = 1 / (1 + np.exp(-np.clip(eta, -30, 30)))
+        return p, p * (1 - p)
+    exp_eta = np.exp(np.clip(eta, -30, 5))
+    return -np.expm1(-exp_eta), np.exp(np.log(exp_eta) - exp_eta)
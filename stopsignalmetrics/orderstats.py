@@ -0,0 +1,90 @@
+from bisect import bisect_left, insort
+
+
+class OrderStatistics:
+    """Sorted multiset of values with O(log n) nth-smallest queries.
+
+    Values are kept in sorted buckets of bounded size, and a Fenwick
+    tree over the bucket sizes finds the bucket holding the nth value.
+    """
+    def __init__(self, values=(), load=256):
+        self._load = load
+        values = sorted(values)
+        self._buckets = [values[i:i + load]
+                         for i in range(0, len(values), load)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(values)
+        self._build_tree()
+
+    def __len__(self):
+        return self._len
+
+    def add(self, value):
+        """Insert a value."""
+        if not self._buckets:
+            self._buckets.append([value])
+            self._maxes.append(value)
+            self._len = 1
+            self._build_tree()
+            return
+        i = min(bisect_left(self._maxes, value), len(self._maxes) - 1)
+        bucket = self._buckets[i]
+        insort(bucket, value)
+        self._maxes[i] = bucket[-1]
+        self._len += 1
+        if len(bucket) > 2 * self._load:
+            self._buckets[i:i + 1] = [bucket[:self._load],
+                                      bucket[self._load:]]
+            self._maxes[i:i + 1] = [bucket[self._load - 1], bucket[-1]]
+            self._build_tree()
+        else:
+            self._update_tree(i, 1)
+
+    def remove(self, value):
+        """Remove one occurrence of a value."""
+        i = bisect_left(self._maxes, value)
+        if i == len(self._maxes):
+            raise ValueError('{} not in OrderStatistics'.format(value))
+        bucket = self._buckets[i]
+        j = bisect_left(bucket, value)
+        if bucket[j] != value:
+            raise ValueError('{} not in OrderStatistics'.format(value))
+        del bucket[j]
+        self._len -= 1
+        if bucket:
+            self._maxes[i] = bucket[-1]
+            self._update_tree(i, -1)
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+            self._build_tree()
+
+    def nth(self, n):
+        """Get the nth smallest value, counting from 0."""
+        if not 0 <= n < self._len:
+            raise IndexError('{} out of range'.format(n))
+        # descend the Fenwick tree to the bucket holding the nth value
+        pos, remaining = 0, n
+        step = 1 << len(self._tree).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= remaining:
+                pos = nxt
+                remaining -= self._tree[nxt]
+            step >>= 1
+        return self._buckets[pos][remaining]
+
+    def _build_tree(self):
+        # 1-indexed Fenwick tree over the bucket sizes
+        tree = [0] + [len(bucket) for bucket in self._buckets]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _update_tree(self, bucket_idx, delta):
+        i = bucket_idx + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
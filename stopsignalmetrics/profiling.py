@@ -0,0 +1,89 @@
+import time
+from collections import OrderedDict
+import pandas as pd
+
+STAGE_FIELDS = ['calls', 'wall_time_s', 'rows', 'bytes_copied']
+
+
+class FitProfile:
+    """Wall time, rows processed and bytes copied by each stage of a fit.
+
+    Stages are timed inclusively, so the 'fit' stage includes every
+    other stage, and repeated stages (e.g. per shard) are summed.
+    """
+    def __init__(self):
+        self._stages = OrderedDict()
+
+    def clear(self):
+        self._stages.clear()
+
+    def stage(self, name, rows=0, nbytes=0):
+        """Context manager timing one stage."""
+        return _Stage(self, name, rows, nbytes)
+
+    def add(self, name, wall_time=0., rows=0, nbytes=0, calls=1):
+        """Add to a stage's totals."""
+        if name not in self._stages:
+            self._stages[name] = dict.fromkeys(STAGE_FIELDS, 0)
+        totals = self._stages[name]
+        totals['calls'] += calls
+        totals['wall_time_s'] += wall_time
+        totals['rows'] += rows
+        totals['bytes_copied'] += nbytes
+
+    def merge(self, records):
+        """Add the records of another profile, e.g. from a worker."""
+        for record in records:
+            self.add(record['stage'], wall_time=record['wall_time_s'],
+                     rows=record['rows'], nbytes=record['bytes_copied'],
+                     calls=record['calls'])
+
+    def to_records(self):
+        """Get a list with a dict per stage."""
+        return [dict(stage=name, **totals)
+                for name, totals in self._stages.items()]
+
+    def report(self):
+        """Get a dataframe with a row per stage, in the order each stage
+        first finished."""
+        return pd.DataFrame(
+            [[totals[field] for field in STAGE_FIELDS]
+             for totals in self._stages.values()],
+            index=pd.Index(list(self._stages.keys()), name='stage'),
+            columns=STAGE_FIELDS)
+
+
+class _Stage:
+    def __init__(self, profile, name, rows, nbytes):
+        self._profile = profile
+        self._name = name
+        self._rows = rows
+        self._nbytes = nbytes
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def add_rows(self, rows):
+        """Count rows found to be processed once the stage started."""
+        self._rows += rows
+
+    def __exit__(self, *exc_info):
+        self._profile.add(self._name, time.perf_counter() - self._start,
+                          self._rows, self._nbytes)
+        return False
+
+
+class _NullStage:
+    """Stage used when profiling is off, which does nothing."""
+    def __enter__(self):
+        return self
+
+    def add_rows(self, rows):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = _NullStage()
@@ -1,12 +1,17 @@
+import re
 import numpy as np
 import pandas as pd
-from sklearn.exceptions import NotFittedError
-from .base import Computer, MultiLevelComputer
+from .base import Computer, MultiLevelComputer, not_fitted_error
+from .grouping import TrialArrays, shift
 
 
 class Sequence(Computer):
-    def __init__(self):
+    def __init__(self, window=1, output='frame'):
+        assert isinstance(window, (int, np.integer)) and window >= 1
+        assert output in ['frame', 'view']
         super().__init__()
+        self._window = window
+        self._output = output
         self._acceptable_index_types = (
             str,
             list,
@@ -18,39 +23,142 @@ class Sequence(Computer):
             pd.core.indexes.numeric.NumericIndex,
             )
 
-    def fit(self, data_df, indices):
-        """Get trial triplets centered on indices."""
+    def fit(self, data_df, indices, columns=None):
+        """Get windows of trials centered on indices.
+
+        Neighbors are found by row position, and only the requested
+        columns (all by default) are gathered. With output='view', a
+        SequenceView is returned that gathers columns on access.
+        """
+        data_df = self._as_frame(data_df)
+        self._start_profile()
+        with self._stage('fit', rows=len(data_df)):
+            self._fit(data_df, indices, columns)
+        # a view needs the data, so it is kept
+        if self._output == 'frame':
+            self._release()
+        return self
+
+    def fit_transform(self, data_df, indices, columns=None):
+        self.fit(data_df, indices, columns=columns)
+        return(self._transformed_data)
+
+    def _fit(self, data_df, indices, columns):
         assert self._is_preprocessed(data_df)
         assert isinstance(indices, self._acceptable_index_types)
-        self._raw_data = data_df.copy()
+        self._raw_data = data_df
+        if columns is None:
+            columns = list(data_df.columns)
 
-        if type(indices) == str:
-            indices = self._raw_data.query(indices).index
-        indices = indices[(indices > self._raw_data.index.min()) &
-                          (indices < self._raw_data.index.max())]
-
-        sequence_df = pd.DataFrame()
-        sequence_df['trial_index'] = indices
-        for shift, pfix in [(-1, 'pre'), (0, 'curr'), (1, 'post')]:
-            for col in self._raw_data.columns:
-                sequence_df['{}_{}'.format(pfix, col)] = self._raw_data.loc[
-                    indices+shift, col].values
-
-        # block match
-        sequence_df = sequence_df[sequence_df['pre_block'] ==
-                                  sequence_df['post_block']]
-
-        # ID match
-        if 'pre_ID' in sequence_df.columns:
-            sequence_df = sequence_df[sequence_df['pre_ID'] ==
-                                      sequence_df['post_ID']]
-
-        self._transformed_data = sequence_df.reset_index(drop=True)
+        with self._stage('positions', rows=len(data_df)):
+            positions = self._get_positions(data_df, indices)
+            positions = positions[(positions >= self._window) &
+                                  (positions < len(data_df) - self._window)]
+
+            # block match
+            keep = self._neighbors_match(data_df['block'], positions)
+
+            # ID match
+            if 'ID' in data_df.columns:
+                keep = keep & self._neighbors_match(data_df['ID'], positions)
+            positions = positions[keep]
+
+        view = SequenceView(data_df, positions, self._window, columns)
+        if self._output == 'view':
+            self._transformed_data = view
+        else:
+            with self._stage('gather', rows=len(positions)):
+                self._transformed_data = view.to_frame()
         return self
 
-    def fit_transform(self, data_df, indices):
-        self.fit(data_df, indices)
-        return(self._transformed_data)
+    def _get_positions(self, data_df, indices):
+        """Convert a query string or index labels to row positions."""
+        if type(indices) == str:
+            return np.flatnonzero(data_df.eval(indices).values)
+        positions = data_df.index.get_indexer(np.asarray(indices))
+        return positions[positions >= 0]
+
+    def _neighbors_match(self, col, positions):
+        """Check that the first and last trials of each window match."""
+        values = col.values
+        return values[positions - self._window] == \
+            values[positions + self._window]
+
+
+class SequenceView:
+    """Lazy windows of trials, gathering a column only when accessed.
+
+    Items are named like the columns of a Sequence frame, e.g.
+    'pre2_goRT', 'pre_goRT', 'curr_goRT', 'post_goRT', 'post2_goRT'.
+    """
+    def __init__(self, data_df, positions, window, columns):
+        self._data = data_df
+        self._positions = positions
+        self.window = window
+        self.offsets = list(range(-window, window + 1))
+        self.columns = list(columns)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __getitem__(self, key):
+        if key == 'trial_index':
+            return self.trial_index
+        pfix, col = key.split('_', 1)
+        return self.get(col, self._offset_from_prefix(pfix))
+
+    def keys(self):
+        return ['trial_index'] + [
+            '{}_{}'.format(offset_prefix(offset), col)
+            for offset in self.offsets for col in self.columns]
+
+    @property
+    def trial_index(self):
+        return self._data.index.values[self._positions]
+
+    def get(self, col, offset):
+        """Gather one column at one offset from the center trials."""
+        assert col in self.columns, '{} not in sequence columns'.format(col)
+        assert offset in self.offsets, \
+            '{} outside of the window'.format(offset)
+        return self._data[col].values[self._positions + offset]
+
+    def window_values(self, col):
+        """Get a (n_centers, window length) array of one column."""
+        assert col in self.columns, '{} not in sequence columns'.format(col)
+        values = np.asarray(self._data[col].values)
+        strided = np.lib.stride_tricks.as_strided(
+            values,
+            shape=(max(len(values) - 2 * self.window, 0),
+                   2 * self.window + 1),
+            strides=(values.strides[0], values.strides[0]),
+            writeable=False)
+        return strided[self._positions - self.window]
+
+    def to_frame(self, columns=None):
+        """Materialize the windows as a Sequence frame."""
+        columns = self.columns if columns is None else columns
+        sequence_dict = {'trial_index': self.trial_index}
+        for offset in self.offsets:
+            for col in columns:
+                sequence_dict['{}_{}'.format(offset_prefix(offset), col)] = \
+                    self.get(col, offset)
+        return pd.DataFrame(sequence_dict,
+                            columns=list(sequence_dict.keys()))
+
+    def _offset_from_prefix(self, pfix):
+        for offset in self.offsets:
+            if offset_prefix(offset) == pfix:
+                return offset
+        raise KeyError('{} is not a prefix of this window'.format(pfix))
+
+
+def offset_prefix(offset):
+    """Column prefix for a trial at some offset from the center trial."""
+    if offset == 0:
+        return 'curr'
+    pfix = 'pre' if offset < 0 else 'post'
+    return pfix if abs(offset) == 1 else '{}{}'.format(pfix, abs(offset))
 
 
 class PostStopSlow(MultiLevelComputer):
@@ -58,80 +166,188 @@ class PostStopSlow(MultiLevelComputer):
         super().__init__()
         self._correct_go_only = correct_go_only
         self._filter_columns = filter_columns
-    
+        self._stop_type = None
+        self._differences = None
+        self._mean_pss = None
+
     def _fit_individual(self, data_df, stop_type='all', query_suffix=None):
-        """Compare go RTs before and after stop trials."""
+        """Compare go RTs before and after stop trials.
+
+        Differences and means are found for every stop type at once;
+        stop_type picks the one that is transformed.
+        """
         assert self._is_preprocessed(data_df)
         assert stop_type in ['all', 'success', 'fail'], \
             "Can only exmine 3 types of stop trials: 'all', 'success', 'fail'."
-        self._raw_data = data_df.copy().reset_index(drop=True)
-        base_query = "condition=='stop'"
-        query = base_query + query_suffix if query_suffix is not None else base_query
-        sequence_df = Sequence().fit_transform(
-            self._raw_data,
-            query
-            )
-
-        if self._filter_columns:
-            sequence_df = sequence_df.filter(
-                regex='|'.join([self._cols[key] for key
-                               in self._cols.keys()] +
-                               ['trial_index']))
+        self._raw_data = data_df
+        self._stop_type = stop_type
+        with self._stage('trial_arrays', rows=len(data_df)):
+            trials = TrialArrays(data_df, level='individual')
+        with self._stage('pss', rows=trials.n_rows):
+            diffs, masks = self._get_pss_masks(
+                trials, self._get_centers(data_df, trials, query_suffix))
+            self._differences = {
+                key: pd.Series(diffs[mask]) for key, mask in masks.items()}
+            self._mean_pss = {
+                key: diff_list.mean() for key, diff_list in
+                self._differences.items()}
 
-        keep_idx = ((sequence_df['pre_condition'] == "go") &
-                    (sequence_df['post_condition'] == "go") &
-                    (sequence_df['pre_goRT'].notnull()) &
-                    (sequence_df['post_goRT'].notnull()))
-
-        if self._correct_go_only:
-            keep_idx = (keep_idx &
-                        (sequence_df['pre_choice_accuracy'] == 1) &
-                        (sequence_df['post_choice_accuracy'] == 1))
-
-        stop_fail_idx = sequence_df['curr_stopRT'].notnull()
-        if stop_type == 'fail':
-            keep_idx = (keep_idx &
-                        stop_fail_idx)
-        if stop_type == 'success':
-            keep_idx = (keep_idx &
-                        ~np.array(stop_fail_idx))
-
-        sequence_df = sequence_df[keep_idx]
+        positions = np.flatnonzero(masks[stop_type])
+        sequence_df = self._get_sequence(data_df, positions)
+        sequence_df['trial_index'] = positions
         if len(sequence_df)==0:
             seq_T = sequence_df.T
             seq_T[0] = None
             sequence_df = seq_T.T
-
-        self._diff_list = (sequence_df['post_goRT'] - sequence_df['pre_goRT'])
-        self._mean_pss = self._diff_list.mean()
-        self._transformed_data = sequence_df.reset_index(drop=True)
+        self._transformed_data = sequence_df
         return self
 
-    def _fit_group(self, data_df, **indiv_kwargs):
-        """Find the mean PSS for each individual."""
+    def _fit_group(self, data_df, stop_type='all', query_suffix=None):
+        """Compare go RTs before and after stop trials for each individual.
+
+        Each subject's trials are indexed by position within the subject,
+        as when fitting them alone; subjects without any kept stop trials
+        get one empty row.
+        """
+        kwargs = self._get_group_kwargs(data_df, stop_type=stop_type,
+                                        query_suffix=query_suffix)
+        self._transformed_data = self._combine_group_shards(
+            [self._fit_group_shard(data_df, **kwargs)])
+
+    def _get_group_kwargs(self, data_df, stop_type='all', query_suffix=None):
+        """Check the stop type, which is kept for the getters."""
+        assert stop_type in ['all', 'success', 'fail'], \
+            "Can only exmine 3 types of stop trials: 'all', 'success', 'fail'."
+        self._stop_type = stop_type
+        return {'stop_type': stop_type, 'query_suffix': query_suffix}
+
+    def _fit_group_shard(self, data_df, stop_type='all', query_suffix=None):
+        """Get the sequences, mean PSS and differences of a shard of
+        subjects, for every stop type."""
         assert self._is_preprocessed(data_df)
-        pss = PostStopSlow(correct_go_only=self._correct_go_only,
-                           filter_columns=self._filter_columns)
-        self._raw_data = data_df.copy()
-        group_out_df = self._raw_data.groupby('ID').apply(
-            pss.fit_transform, **indiv_kwargs)
-        self._transformed_data = group_out_df
-
-    def get_diff_list(self):
-        """Get differences between goRTs before and after some stop trials."""
+        self._raw_data = data_df
+        with self._stage('trial_arrays', rows=len(data_df)):
+            trials = TrialArrays(data_df)
+        groups = trials.groups
+        with self._stage('pss', rows=trials.n_rows):
+            diffs, masks = self._get_pss_masks(
+                trials, self._get_centers(data_df, trials, query_suffix))
+            mean_pss = {
+                key: pd.Series(groups.mean(diffs, mask), index=groups.ids)
+                for key, mask in masks.items()}
+            differences = {
+                key: pd.Series(diffs[mask], index=self._get_group_index(
+                    trials, np.flatnonzero(mask)))
+                for key, mask in masks.items()}
+
+        positions = np.flatnonzero(masks[stop_type])
+        subject_starts = np.searchsorted(groups.codes,
+                                         np.arange(groups.n_groups))
+        sequence_df = self._get_sequence(data_df, positions, trials.order)
+        sequence_df['trial_index'] = \
+            positions - subject_starts[groups.codes[positions]]
+        sequence_df.index = self._get_group_index(trials, positions)
+        empty_ids = groups.ids[groups.count(masks[stop_type]) == 0]
+        if len(empty_ids) > 0:
+            sequence_df = pd.concat([
+                sequence_df,
+                pd.DataFrame(index=pd.MultiIndex.from_arrays(
+                    [empty_ids, np.zeros(len(empty_ids), dtype=np.int64)],
+                    names=sequence_df.index.names),
+                    columns=sequence_df.columns)]).sort_index(
+                        level='ID', sort_remaining=False)
+        return sequence_df, mean_pss, differences
+
+    def _combine_group_shards(self, results):
+        """Stack the sequences of every shard, keeping the mean PSS and
+        differences of every stop type for the getters."""
+        sequences, mean_pss, differences = zip(*results)
+        self._mean_pss = {
+            key: pd.concat([shard[key] for shard in mean_pss])
+            for key in mean_pss[0].keys()}
+        self._differences = {
+            key: pd.concat([shard[key] for shard in differences])
+            for key in differences[0].keys()}
+        return pd.concat(sequences)
+
+    def _get_pss_masks(self, trials, centers=None):
+        """Get post minus pre go RT differences at every trial, and masks
+        of the stop trials kept for each stop type."""
+        keep = (trials.has_neighbors & trials.is_stop &
+                shift(trials.go_resp, -1) & shift(trials.go_resp, 1))
+        if self._correct_go_only:
+            acc = trials.acc if trials.acc is not None \
+                else np.full(trials.n_rows, np.nan)
+            keep = keep & (shift(acc, -1) == 1) & (shift(acc, 1) == 1)
+        if centers is not None:
+            keep = keep & centers
+        diffs = shift(trials.goRT, 1) - shift(trials.goRT, -1)
+        return diffs, {
+            'all': keep,
+            'success': keep & ~trials.stop_fail,
+            'fail': keep & trials.stop_fail,
+        }
+
+    def _calc_group_pss(self, trials):
+        """Get each subject's mean PSS for every stop type at once."""
+        diffs, masks = self._get_pss_masks(trials)
+        return {key: trials.groups.mean(diffs, mask)
+                for key, mask in masks.items()}
+
+    def _get_centers(self, data_df, trials, query_suffix):
+        """Mask of the stop trials matching a query suffix, in trial order."""
+        if query_suffix is None:
+            return None
+        return np.asarray(data_df.eval("condition=='stop'" + query_suffix),
+                          dtype=bool)[trials.order]
+
+    def _get_sequence(self, data_df, positions, order=None):
+        """Gather the triplets of trials centered on positions, in trial
+        order."""
+        columns = list(data_df.columns)
+        if self._filter_columns:
+            col_regex = re.compile('|'.join(
+                [self._cols[key] for key in self._cols.keys()] +
+                ['trial_index']))
+            columns = [col for col in columns if col_regex.search(col)]
+        with self._stage('sequence', rows=len(positions)):
+            data_df = data_df[columns]
+            if order is not None:
+                data_df = data_df.iloc[order]
+            return SequenceView(data_df, positions, 1, columns).to_frame()
+
+    def _get_group_index(self, trials, positions):
+        """Index trials by ID and by their number within the subject."""
+        codes = trials.groups.codes[positions]
+        first = np.searchsorted(codes, np.arange(trials.groups.n_groups))
+        return pd.MultiIndex.from_arrays(
+            [trials.groups.ids[codes],
+             np.arange(len(positions)) - first[codes]],
+            names=['ID', None])
+
+    def get_diff_list(self, stop_type=None):
+        """Get differences between goRTs before and after some stop trials.
+
+        stop_type defaults to the fitted stop type.
+        """
         try:
             assert self._differences is not None
         except AssertionError:
-            raise NotFittedError('Data must first be loaded using .fit()')
-        return(self._differences)
+            raise not_fitted_error('Data must first be loaded using .fit()')
+        return(self._differences[
+            self._stop_type if stop_type is None else stop_type])
+
+    def get_mean_pss(self, stop_type=None):
+        """Get mean post stop slowing, per ID for a group.
 
-    def get_mean_pss(self):
-        """Get mean post stop slowing."""
+        stop_type defaults to the fitted stop type.
+        """
         try:
             assert self._mean_pss is not None
         except AssertionError:
-            raise NotFittedError('Data must first be loaded using .fit()')
-        return(self._mean_pss)
+            raise not_fitted_error('Data must first be loaded using .fit()')
+        return(self._mean_pss[
+            self._stop_type if stop_type is None else stop_type])
 
 
 class Violations(MultiLevelComputer):
@@ -148,71 +364,98 @@ class Violations(MultiLevelComputer):
         try:
             assert self._transformed_data is not None
         except AssertionError:
-            raise NotFittedError('Data must first be loaded using .fit()')
+            raise not_fitted_error('Data must first be loaded using .fit()')
         return(self._transformed_data.query(
             "SSD < {}".format(self._mean_thresh))[
                 'mean_violation'
             ].mean())
 
     # private functions
+    def _calc_group_violations(self, trials, centers=None):
+        """Get violation info per SSD for every subject at once.
+
+        centers optionally restricts the stop-failure trials considered.
+        """
+        pre_goRT = shift(trials.goRT, -1)
+        keep = (trials.has_neighbors & trials.stop_fail &
+                shift(trials.go_resp, -1) & (trials.groups.codes >= 0))
+        if centers is not None:
+            keep = keep & centers
+        pairs = pd.DataFrame({
+            'ID': trials.groups.codes[keep],
+            'SSD': trials.SSD[keep],
+            'stopRT': trials.stopRT[keep],
+            'goRT': pre_goRT[keep],
+        })
+        pairs['violation'] = pairs['stopRT'] - pairs['goRT']
+        info_df = pairs.groupby(['ID', 'SSD']).agg(
+            n_go_stopfail_pairs=('violation', 'size'),
+            mean_violation=('violation', 'mean'),
+            mean_stopFailureRT=('stopRT', 'mean'),
+            mean_precedingGoRT=('goRT', 'mean')).reset_index()
+        info_df['ID'] = trials.groups.ids[info_df['ID'].values]
+        return info_df[info_df['n_go_stopfail_pairs'] >=
+                       self._n_pair_thresh].reset_index(drop=True)
+
+    def _calc_group_mean_below_thresh(self, trials):
+        """Get each subject's mean violation at SSDs below a threshold."""
+        va_df = self._calc_group_violations(trials)
+        va_df = va_df[va_df['SSD'] < self._mean_thresh]
+        return va_df.groupby('ID')['mean_violation'].mean().reindex(
+            trials.groups.ids).values
+
+    def _get_centers(self, data_df, trials, query_suffix):
+        """Mask of the trials matching a query suffix, in trial order."""
+        if query_suffix is None:
+            return None
+        base_query = "condition=='stop' & stopRT==stopRT" # this looks for stop failures
+        return np.asarray(data_df.eval(base_query + query_suffix),
+                          dtype=bool)[trials.order]
+
     def _fit_individual(self, data_df, query_suffix=None):
         """Find the mean violation at each SSD for an individual."""
         assert self._is_preprocessed(data_df)
-        self._raw_data = data_df.copy()
-        base_query = "condition=='stop' & stopRT==stopRT" # this looks for stop failures
-        query = base_query + query_suffix if query_suffix is not None else base_query
-        seq_df = Sequence().fit_transform(self._raw_data,
-                                          query)
-
-        # filter to keep only previous Go trials, no omissions
-        keep_idx = ((seq_df['pre_condition'] == 'go') &
-                    (seq_df['pre_goRT'].notnull()))
-        seq_df = seq_df[keep_idx]
-
-        # build up violation info per ssd
-        info = []
-        SSDs = seq_df['curr_SSD'].unique()
-        for ssd in SSDs:
-            ssd_df = seq_df[seq_df['curr_SSD'] == ssd].copy()
-            info.append([ssd,
-                         ssd_df.shape[0],
-                         (ssd_df['curr_stopRT'] - ssd_df['pre_goRT']).mean(),
-                         ssd_df['curr_stopRT'].mean(),
-                         ssd_df['pre_goRT'].mean()])
-
-        # convert to df and threshold
-        info_df = pd.DataFrame(info,
-                               columns=['SSD',
-                                        'n_go_stopfail_pairs',
-                                        'mean_violation',
-                                        'mean_stopFailureRT',
-                                        'mean_precedingGoRT'])
-        va_df = info_df.query('n_go_stopfail_pairs >= {}'.format(
-            self._n_pair_thresh))
-        self._transformed_data = va_df.sort_values(
-            by=self._cols["SSD"]
-            ).set_index('SSD')
+        self._raw_data = self._copy(data_df)
+        with self._stage('trial_arrays', rows=len(data_df)):
+            trials = TrialArrays(self._raw_data, level='individual')
+        with self._stage('violations', rows=trials.n_rows):
+            va_df = self._calc_group_violations(
+                trials,
+                self._get_centers(self._raw_data, trials, query_suffix))
+        self._transformed_data = va_df.drop(columns='ID').set_index(
+            self._cols["SSD"])
 
     def _fit_group(self, data_df, **indiv_kwargs):
         """Find the mean violation at each SSD for each individual."""
+        self._transformed_data = self._threshold_group_ssds(
+            self._fit_group_shard(data_df, **indiv_kwargs))
+
+    def _fit_group_shard(self, data_df, query_suffix=None):
+        """Find violations per SSD, before thresholding across subjects."""
         assert self._is_preprocessed(data_df)
-        violation = Violations(mean_thresh=self._mean_thresh,
-                               n_pair_thresh=self._n_pair_thresh,
-                               verbose=self._verbose)
-        self._raw_data = data_df.copy()
-        group_va_df = self._raw_data.groupby('ID').apply(
-            violation.fit_transform, **indiv_kwargs)
-        group_va_df = group_va_df.reset_index()
-        all_ssdvals = group_va_df['SSD'].unique()
-        all_ssdvals.sort()
-        for ssd in all_ssdvals:
-            group_va_df_ssd = group_va_df.query('SSD == %d' % ssd)
-            if self._verbose:
-                print(ssd, 'n subs:', group_va_df_ssd.shape[0])
-            if group_va_df_ssd.shape[0] < self._ssd_quantity_thresh:
-                group_va_df = group_va_df.query('SSD != %d' % ssd)
-                if self._verbose:
+        self._raw_data = data_df
+        with self._stage('trial_arrays', rows=len(data_df)):
+            trials = TrialArrays(data_df)
+        with self._stage('violations', rows=trials.n_rows):
+            return self._calc_group_violations(
+                trials, self._get_centers(data_df, trials, query_suffix))
+
+    def _combine_group_shards(self, results):
+        """Threshold SSDs across the subjects of every shard."""
+        return self._threshold_group_ssds(
+            pd.concat(results, ignore_index=True))
+
+    def _threshold_group_ssds(self, group_va_df):
+        """Drop SSDs with too few subjects."""
+        if self._verbose:
+            for ssd, n_sub in group_va_df['SSD'].value_counts()\
+                    .sort_index().items():
+                print(ssd, 'n subs:', n_sub)
+                if n_sub < self._ssd_quantity_thresh:
                     print('\tdropping', ssd)
-        group_va_df = group_va_df.sort_values(
-            ['ID', 'SSD']).reset_index(drop=True)
-        self._transformed_data = group_va_df
+        with self._stage('threshold', rows=len(group_va_df)):
+            n_subs = group_va_df.groupby('SSD')['ID'].transform('size')
+            group_va_df = group_va_df[
+                n_subs.values >= self._ssd_quantity_thresh]
+            return group_va_df.sort_values(
+                ['ID', 'SSD']).reset_index(drop=True)
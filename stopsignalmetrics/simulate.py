@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+from .grouping import nth_index
+
+
+def simulate_race(n_subjects=1, n_trials=400, n_blocks=4, p_stop=.25,
+                  omission_rate=.02, choice_error_rate=.05,
+                  go_mu=450, go_mu_sd=50, go_sigma=50, go_tau=100,
+                  SSRT_mean=250, SSRT_sd=30, SSRT_trial_sd=0,
+                  SSD_start=250, SSD_step=50, SSD_min=0, SSD_max=1000,
+                  seed=None, return_SSRTs=False):
+    """Simulate subjects of the independent race model as standardized data.
+
+    Go RTs are ex-Gaussian, with a mean (go_mu) varying over subjects and
+    a go_sigma/go_tau shared by all. Each subject has a true SSRT, drawn
+    from Normal(SSRT_mean, SSRT_sd); trials vary around it by
+    SSRT_trial_sd. SSDs follow a one-up/one-down staircase per subject,
+    going up by SSD_step after a stop success and down after a failure.
+    The go process fails to finish on omission_rate of all trials, and
+    responses are the wrong choice on choice_error_rate of them.
+
+    With return_SSRTs=True, the true SSRT of each subject is also
+    returned, as a series indexed by ID.
+    """
+    assert n_subjects >= 1 and n_trials >= 1
+    assert 1 <= n_blocks <= n_trials
+    rng = np.random.default_rng(seed)
+    shape = (n_subjects, n_trials)
+    trials = _simulate_trials(
+        rng, n_subjects, n_trials, p_stop=p_stop,
+        omission_rate=omission_rate, go_mu=go_mu, go_mu_sd=go_mu_sd,
+        go_sigma=go_sigma, go_tau=go_tau, SSRT_mean=SSRT_mean,
+        SSRT_sd=SSRT_sd, SSRT_trial_sd=SSRT_trial_sd, SSD_start=SSD_start,
+        SSD_step=SSD_step, SSD_min=SSD_min, SSD_max=SSD_max)
+    is_stop, responded = trials['is_stop'], trials['responded']
+    SSD, subject_SSRT = trials['SSD'], trials['SSRT']
+
+    keys = np.array(['left', 'right'], dtype=object)
+    correct_key = rng.integers(0, 2, size=shape)
+    error = rng.random(shape) < choice_error_rate
+    response = np.where(responded, keys[correct_key ^ error], np.nan)
+    block = np.arange(n_trials) * n_blocks // n_trials + 1
+
+    data_df = pd.DataFrame({
+        'ID': np.repeat(np.arange(1, n_subjects + 1), n_trials),
+        'block': np.tile(block, n_subjects),
+        'condition': np.where(is_stop, 'stop', 'go').astype(object).ravel(),
+        'SSD': SSD.ravel(),
+        'goRT': trials['goRT'].ravel(),
+        'stopRT': trials['stopRT'].ravel(),
+        'response': response.ravel(),
+        'correct_response': keys[correct_key].ravel(),
+        'choice_accuracy': (responded & ~error).astype(np.int64).ravel(),
+    })
+    if return_SSRTs:
+        return data_df, pd.Series(subject_SSRT, name='SSRT',
+                                  index=pd.Index(np.arange(1, n_subjects + 1),
+                                                 name='ID'))
+    return data_df
+
+
+def batch_SSRT(is_stop, goRT, stopRT, SSD, max_RT=None):
+    """Estimate SSRT by every method for many subjects at once.
+
+    Arguments are (subjects, trials) arrays, with NaN RTs for
+    non-responses and NaN SSDs on go trials, as from standardized data.
+    Estimates match SSRTmodel, with max_RT defaulting to each subject's
+    largest go RT, as in individual fits. Returns a dict of arrays by
+    method, NaN where SSRT is undefined (p_respond of 0 or 1).
+    """
+    is_stop = np.asarray(is_stop, dtype=bool)
+    is_go = ~is_stop
+    go_resp = is_go & ~np.isnan(goRT)
+    num_stop = is_stop.sum(axis=1)
+    num_go = is_go.sum(axis=1)
+    counts = go_resp.sum(axis=1)
+    omission_count = num_go - counts
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p_respond = (is_stop & ~np.isnan(stopRT)).sum(axis=1) / num_stop
+        omission_rate = omission_count / num_go
+        mean_SSD = np.nansum(SSD, axis=1) / (~np.isnan(SSD)).sum(axis=1)
+
+    # NaNs sort last, so each row starts with its sorted go RTs
+    sorted_RTs = np.sort(np.where(go_resp, goRT, np.nan), axis=1)
+    rows = np.arange(len(sorted_RTs))
+    has_RTs = counts > 0
+    if max_RT is None:
+        max_RT = sorted_RTs[rows, np.maximum(counts - 1, 0)]
+
+    def nth_RT(P_respond):
+        nth = nth_index(P_respond, counts)
+        return np.where(has_RTs, sorted_RTs[rows, nth], np.nan)
+
+    def replacement_RT(P_respond):
+        # omissions are appended as max_RT after the sorted go RTs
+        nth = nth_index(P_respond, counts + omission_count)
+        in_RTs = has_RTs & (nth < counts)
+        return np.where(in_RTs,
+                        sorted_RTs[rows, np.minimum(nth, counts - 1)],
+                        max_RT)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        nrt_dict = {
+            'mean': np.where(has_RTs, np.nansum(sorted_RTs, axis=1) /
+                             counts, np.nan),
+            'integration': nth_RT(p_respond),
+            'omission': nth_RT(p_respond / (1 - omission_rate)),
+            'replacement': replacement_RT(p_respond),
+        }
+        valid = (p_respond > 0) & (p_respond < 1)
+    return {method: np.where(valid, nrt - mean_SSD, np.nan)
+            for method, nrt in nrt_dict.items()}
+
+
+def compare_SSRT_methods(n_subjects=10000, n_trials=400, chunk_size=10000,
+                         max_RT=None, seed=None, **race_kwargs):
+    """Get the bias and variance of each SSRT method on simulated subjects.
+
+    Subjects are simulated and estimated in chunks of chunk_size, as
+    arrays, so memory does not grow with n_subjects. race_kwargs are
+    passed to the race model, as in simulate_race. Returns a dataframe
+    indexed by method, with the bias, variance and RMSE of the
+    estimates against each subject's true SSRT, and n, the number of
+    subjects with an estimate.
+    """
+    assert n_subjects >= 1 and n_trials >= 1 and chunk_size >= 1
+    rng = np.random.default_rng(seed)
+    methods = ['mean', 'integration', 'omission', 'replacement']
+    # running sums of the errors, their squares and counts per method
+    totals = {method: np.zeros(3) for method in methods}
+    for start in range(0, n_subjects, chunk_size):
+        trials = _simulate_trials(rng, min(chunk_size, n_subjects - start),
+                                  n_trials, **race_kwargs)
+        estimates = batch_SSRT(trials['is_stop'], trials['goRT'],
+                               trials['stopRT'], trials['SSD'],
+                               max_RT=max_RT)
+        for method in methods:
+            error = estimates[method] - trials['SSRT']
+            error = error[~np.isnan(error)]
+            totals[method] += [error.sum(), (error ** 2).sum(), len(error)]
+
+    rows = []
+    for method in methods:
+        error_sum, squared_sum, n = totals[method]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bias = error_sum / n
+            mean_squared = squared_sum / n
+        rows.append({'bias': bias,
+                     'variance': mean_squared - bias ** 2,
+                     'RMSE': np.sqrt(mean_squared),
+                     'n': int(n)})
+    return pd.DataFrame(rows, index=pd.Index(methods, name='method'),
+                        columns=['bias', 'variance', 'RMSE', 'n'])
+
+
+def _simulate_trials(rng, n_subjects, n_trials, p_stop=.25,
+                     omission_rate=.02, go_mu=450, go_mu_sd=50, go_sigma=50,
+                     go_tau=100, SSRT_mean=250, SSRT_sd=30, SSRT_trial_sd=0,
+                     SSD_start=250, SSD_step=50, SSD_min=0, SSD_max=1000):
+    """Simulate the race as (subjects, trials) arrays, without choices."""
+    assert 0 <= p_stop <= 1
+    shape = (n_subjects, n_trials)
+
+    # subject parameters
+    subject_mu = rng.normal(go_mu, go_mu_sd, size=n_subjects)
+    subject_SSRT = rng.normal(SSRT_mean, SSRT_sd, size=n_subjects)
+
+    # trial processes
+    is_stop = rng.random(shape) < p_stop
+    go_finish = (rng.normal(subject_mu[:, None], go_sigma, size=shape) +
+                 rng.exponential(go_tau, size=shape))
+    go_finish = np.maximum(go_finish, 1.)
+    go_finish[rng.random(shape) < omission_rate] = np.inf
+    trial_SSRT = subject_SSRT[:, None] + \
+        rng.normal(0, SSRT_trial_sd, size=shape) if SSRT_trial_sd > 0 \
+        else np.broadcast_to(subject_SSRT[:, None], shape)
+
+    # staircase, stepping every subject through its trials at once
+    SSD = np.full(shape, np.nan)
+    responded = ~is_stop & np.isfinite(go_finish)
+    current_SSD = np.full(n_subjects, float(SSD_start))
+    for trial in range(n_trials):
+        stop = is_stop[:, trial]
+        SSD[stop, trial] = current_SSD[stop]
+        stop_fail = stop & (go_finish[:, trial] <
+                            current_SSD + trial_SSRT[:, trial])
+        responded[:, trial] |= stop_fail
+        current_SSD[stop] = np.clip(
+            current_SSD[stop] + np.where(stop_fail[stop], -SSD_step,
+                                         SSD_step),
+            SSD_min, SSD_max)
+
+    RTs = np.where(responded, np.rint(go_finish), np.nan)
+    return {'is_stop': is_stop, 'responded': responded, 'SSD': SSD,
+            'goRT': np.where(is_stop, np.nan, RTs),
+            'stopRT': np.where(is_stop, RTs, np.nan),
+            'SSRT': subject_SSRT}
@@ -1,32 +1,108 @@
+import multiprocessing
+import warnings
 import numpy as np
 import pandas as pd
-from sklearn.exceptions import NotFittedError
-from .base import MultiLevelComputer
+from .base import Computer, MultiLevelComputer, not_fitted_error,\
+    n_processes
+from .grouping import TrialArrays, as_float, nth_index, select_nth
+from .orderstats import OrderStatistics
+
+
+def _exgauss():
+    """Import the ex-Gaussian model only when it is used, as scipy is slow
+    to import."""
+    from . import exgauss
+    return exgauss
 
 
 class SSRTmodel(MultiLevelComputer):
     def __init__(self, model='replacement'):
         assert model in ['replacement', 'omission',
-                         'integration', 'mean', 'all']
+                         'integration', 'mean', 'all', 'exgauss']
         super().__init__()
         self.model = model
         self._metrics = None
         self._qa = None
+        self._trials = None
+
+    def fit(self, data_df, level='individual', n_jobs=1, **kwargs):
+        # drop trial arrays held from an earlier fit
+        self._trials = None
+        return super().fit(data_df, level=level, n_jobs=n_jobs, **kwargs)
 
     # UNFINISHED
     def check_behavior(self):
         try:
             assert self.coefficients_ is not None
         except AssertionError:
-            raise NotFittedError('Model must first be fitted using .fit()')
+            raise not_fitted_error('Model must first be fitted using .fit()')
         # compute QA metrics
         self._qa = pd.DataFrame()
 
+    def bootstrap(self, n_resamples=1000, seed=None, ci=.95, n_jobs=1):
+        """Get bootstrap confidence intervals for the fitted SSRT.
+
+        Go and stop trials are resampled separately as index matrices,
+        and nth RTs are found for every resample at once by sorting
+        the resampled ranks of the go RTs. max_RT is held at its fitted
+        value. Returns a dict for
+        an individual, or a dataframe indexed by ID for a group.
+        """
+        try:
+            assert self._transformed_data is not None
+        except AssertionError:
+            raise not_fitted_error('Model must first be fitted using .fit()')
+        assert 0 < ci < 1
+        assert self.model != 'exgauss',\
+            'bootstrapping is not supported for the exgauss model'
+        trials = self._trials if self._trials is not None else \
+            TrialArrays(self._as_frame(self._raw_data), level=self._level)
+        if self._level == 'group':
+            max_RTs = self._transformed_data['max_RT'].values
+        else:
+            max_RTs = [self._metrics['max_RT']]
+        methods = ['mean', 'integration', 'omission', 'replacement'] \
+            if self.model == 'all' else [self.model]
+        seeds = np.random.SeedSequence(seed).spawn(trials.groups.n_groups)
+
+        subject_args = []
+        for rows, max_RT, subject_seed in zip(trials.subject_slices(),
+                                              max_RTs, seeds):
+            is_go = trials.is_go[rows]
+            is_stop = trials.is_stop[rows]
+            subject_args.append((trials.goRT[rows][is_go],
+                                 trials.stop_fail[rows][is_stop],
+                                 trials.SSD[rows][is_stop],
+                                 max_RT, subject_seed, n_resamples, methods))
+        n_jobs = n_processes(n_jobs)
+        if n_jobs != 1:
+            with multiprocessing.Pool(n_jobs) as pool:
+                samples = pool.starmap(_bootstrap_SSRTs, subject_args)
+        else:
+            samples = [_bootstrap_SSRTs(*args) for args in subject_args]
+
+        out_df = pd.DataFrame(index=trials.groups.ids)
+        for method in methods:
+            method_samples = np.array([sample[method] for sample in samples])
+            prefix = 'SSRT_' + method if self.model == 'all' else 'SSRT'
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                out_df[prefix + '_lower'] = np.nanpercentile(
+                    method_samples, 100 * (1 - ci) / 2, axis=1)
+                out_df[prefix + '_upper'] = np.nanpercentile(
+                    method_samples, 100 * (1 + ci) / 2, axis=1)
+                out_df[prefix + '_se'] = np.nanstd(method_samples, axis=1,
+                                                   ddof=1)
+        if self._level == 'group':
+            return out_df
+        return out_df.iloc[0].to_dict()
+
     def _fit_individual(self, data_df, max_RT=None):
         """Get SSRT and related metrics for an individual."""
         assert self._is_preprocessed(data_df)
         # fit the model for a single subject
-        self._raw_data = data_df.copy()
+        self._raw_data = self._copy(data_df)
+        self._trials = None
         self._metrics = {
             'SSRT': None,
             'mean_SSD': None,
@@ -41,58 +117,86 @@ class SSRTmodel(MultiLevelComputer):
             'go_acc': None,
             'stopfail_acc': None,
         }
-        self._calc_RTs()
-
-        self._calc_mean_SSD()
-        self._calc_p_respond()
-        self._calc_omission_nums()
-        if 'choice_accuracy' in self._raw_data.columns:
-            self._calc_accs()
-        if self._metrics['max_RT'] is None:
-            _ = self._calc_max_RT()
-        if (self._metrics['p_respond'] is not None) and (self._metrics['p_respond'] > 0 and self._metrics['p_respond'] < 1) :
-            self._calc_SSRT()
+        if self.model == 'exgauss':
+            self._metrics.update(dict.fromkeys(_exgauss().COLUMNS[1:]))
+        with self._stage('metrics', rows=len(self._raw_data)):
+            self._calc_RTs()
+
+            self._calc_mean_SSD()
+            self._calc_p_respond()
+            self._calc_omission_nums()
+            if 'choice_accuracy' in self._raw_data.columns:
+                self._calc_accs()
+            if self._metrics['max_RT'] is None:
+                _ = self._calc_max_RT()
+            if (self._metrics['p_respond'] is not None) and (self._metrics['p_respond'] > 0 and self._metrics['p_respond'] < 1) :
+                self._calc_SSRT()
         self._transformed_data = self._metrics.copy()
         return self
 
-    def _fit_group(self, data_df):
+    def _fit_group(self, data_df, max_RT=None):
         """Get SSRT and related metrics for group data."""
         assert self._is_preprocessed(data_df)
-        self._raw_data = data_df.copy()
+        self._raw_data = self._copy(data_df)
+        self._trials = None
 
-        self._metrics = {}
-        groupmaxRT = self._calc_max_RT()
+        self._metrics = {'max_RT': max_RT}
+        groupmaxRT = self._calc_max_RT() if max_RT is None else max_RT
 
-        group_metrics = data_df.groupby('ID').apply(
-            lambda x: SSRTmodel(model=self.model)
-            ._fit_individual(x, max_RT=groupmaxRT)
-            .transform()).apply(pd.Series)
-        if self.model == 'all':
-            group_metrics = pd.concat([group_metrics['SSRT']
-                                      .apply(pd.Series).add_prefix('SSRT_'),
-                                      group_metrics], 1)
-            del group_metrics['SSRT']
-        self._transformed_data = group_metrics
+        with self._stage('trial_arrays', rows=len(self._raw_data)):
+            trials = TrialArrays(self._raw_data)
+        self._hold_trials(trials)
+        with self._stage('metrics', rows=trials.n_rows):
+            self._transformed_data = self._calc_group_metrics(
+                trials, groupmaxRT)
+
+    def _hold_trials(self, trials):
+        """Keep trial arrays built while fitting, in zero-copy mode, so
+        bootstrapping does not need the data."""
+        if self._zero_copy:
+            self._trials = trials
+
+    def _keep_derived(self, data_df):
+        """Keep the trial arrays needed to bootstrap, building them only
+        if the fit did not (individual and parallel group fits)."""
+        if self._trials is None:
+            self._trials = TrialArrays(self._as_frame(data_df),
+                                       level=self._level)
+
+    def _get_group_kwargs(self, data_df, max_RT=None):
+        """Share the group's max RT with every shard."""
+        if max_RT is None:
+            max_RT = data_df['goRT'].max()
+        return {'max_RT': max_RT}
 
     # private functions
     def _calc_SSRT(self):
         """ Calculate the SSRT via 4 supported methods."""
-        goRTs = self._get_all_goRTs(sort=True)
+        if self.model == 'exgauss':
+            return self._calc_exgauss_SSRT()
+        goRTs = self._get_all_goRTs()
         P_respond = self._metrics['p_respond']
+        n_RTs = len(goRTs)
+
+        # one selection pass finds the nth RTs of every method
+        nth_dict = {
+            'integration': lambda: nth_index(P_respond, n_RTs),
+            'omission': lambda: nth_index(P_respond/(1-self._metrics['omission_rate']), # corrected P(resp)
+                                          n_RTs),
+            'replacement': lambda: nth_index(P_respond,
+                                             n_RTs + self._metrics['omission_count']), # omissions replaced by max_RT
+        }
+        methods = list(nth_dict.keys()) if self.model == 'all' else \
+            [self.model]
+        nths = {k: int(nth_dict[k]()) for k in methods if k in nth_dict}
+        partitioned_RTs = select_nth(goRTs, list(nths.values()))
 
         nrt_dict = {
-            'mean': lambda : np.mean(goRTs),
-            'integration': lambda : self._get_nth_RT(P_respond,
-                                                     goRTs
-                                                     ),
-            'omission': lambda : self._get_nth_RT(P_respond/(1-self._metrics['omission_rate']), # corrected P(resp)
-                                                  goRTs
-                                                  ),
-            'replacement': lambda : self._get_nth_RT(P_respond,     
-                                                     np.concatenate((
-            goRTs,
-            [self._metrics['max_RT']] * self._metrics['omission_count'])) # appending max_RT to replace omissions
-                                                     ),
+            'mean': lambda: np.mean(goRTs),
+            'integration': lambda: partitioned_RTs[nths['integration']],
+            'omission': lambda: partitioned_RTs[nths['omission']],
+            'replacement': lambda: partitioned_RTs[nths['replacement']]
+            if nths['replacement'] < n_RTs else self._metrics['max_RT'],
         }
         # out_dict = {
         #     key: nrt - self._metrics['mean_SSD']
@@ -109,6 +213,109 @@ class SSRTmodel(MultiLevelComputer):
         else:
             self._metrics['SSRT'] = nrt_dict[self.model]() - self._metrics['mean_SSD']
 
+    def _calc_exgauss_SSRT(self):
+        """Fit ex-Gaussian go and stop distributions, starting from the
+        integration method's SSRT."""
+        goRTs = self._get_all_goRTs()
+        if len(goRTs) == 0:
+            return
+        nth = int(nth_index(self._metrics['p_respond'], len(goRTs)))
+        start_SSRT = select_nth(goRTs, [nth])[nth] - \
+            self._metrics['mean_SSD']
+        trials = TrialArrays(self._raw_data, level='individual')
+        self._hold_trials(trials)
+        with self._stage('exgauss', rows=len(self._raw_data)):
+            fit = _exgauss().fit_race(trials, [start_SSRT]).iloc[0].to_dict()
+        self._metrics['SSRT'] = fit.pop('SSRT')
+        self._metrics.update(fit)
+
+    def _calc_group_metrics(self, trials, max_RT):
+        """Compute every metric for all subjects with grouped reductions."""
+        groups = trials.groups
+        goRT, stopRT, SSD = trials.goRT, trials.stopRT, trials.SSD
+        go_resp, stop_fail = trials.go_resp, trials.stop_fail
+
+        num_stop = groups.count(trials.is_stop)
+        num_go = groups.count(trials.is_go)
+        num_go_resp = groups.count(go_resp)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            p_respond = np.where(num_stop > 0,
+                                 groups.count(stop_fail) / num_stop,
+                                 np.nan)
+            omission_count = num_go - num_go_resp
+            omission_rate = omission_count / num_go
+
+        metrics = pd.DataFrame(index=groups.ids)
+        metrics['SSRT'] = np.nan
+        metrics['mean_SSD'] = groups.mean(SSD, ~np.isnan(SSD))
+        metrics['p_respond'] = p_respond
+        metrics['max_RT'] = max_RT
+        metrics['mean_go_RT'] = groups.mean(goRT, go_resp)
+        metrics['sd_go_RT'] = groups.std(goRT, go_resp)
+        metrics['mean_stopfail_RT'] = groups.mean(stopRT, stop_fail)
+        metrics['sd_stopfail_RT'] = groups.std(stopRT, stop_fail, ddof=1)
+        metrics['omission_count'] = omission_count
+        metrics['omission_rate'] = omission_rate
+        if trials.acc is not None:
+            acc = trials.acc
+            has_acc = ~np.isnan(acc)
+            metrics['go_acc'] = groups.mean(acc, go_resp & has_acc)
+            metrics['stopfail_acc'] = groups.mean(acc, stop_fail & has_acc)
+        else:
+            metrics['go_acc'] = None
+            metrics['stopfail_acc'] = None
+
+        # nth RTs from each subject's sorted run of go RTs, padded so that
+        # subjects without go RTs can be indexed safely and then masked
+        sorted_RTs, starts, counts = groups.sort_within(goRT, go_resp)
+        sorted_RTs = np.append(sorted_RTs, np.nan)
+        has_RTs = counts > 0
+
+        def nth_RT(P_respond):
+            nth = nth_index(P_respond, counts)
+            return np.where(has_RTs, sorted_RTs[starts + nth], np.nan)
+
+        def replacement_RT(P_respond):
+            # omissions are appended as max_RT after the sorted go RTs
+            nth = nth_index(P_respond, counts + omission_count)
+            in_RTs = has_RTs & (nth < counts)
+            return np.where(in_RTs,
+                            sorted_RTs[starts + np.minimum(nth, counts)],
+                            max_RT)
+
+        nrt_dict = {
+            'mean': lambda: metrics['mean_go_RT'].values,
+            'integration': lambda: nth_RT(p_respond),
+            'omission': lambda: nth_RT(p_respond / (1 - omission_rate)),
+            'replacement': lambda: replacement_RT(p_respond),
+        }
+        with np.errstate(invalid='ignore', divide='ignore'):
+            valid = (p_respond > 0) & (p_respond < 1)
+            if self.model == 'all':
+                SSRTs = pd.DataFrame(
+                    {'SSRT_{}'.format(k): np.where(
+                        valid, func() - metrics['mean_SSD'].values, np.nan)
+                     for k, func in nrt_dict.items()},
+                    index=groups.ids)
+                del metrics['SSRT']
+                metrics = pd.concat([SSRTs, metrics], axis=1)
+            elif self.model == 'exgauss':
+                # fits start from the integration method's SSRT
+                start_SSRTs = np.where(
+                    valid, nth_RT(p_respond) - metrics['mean_SSD'].values,
+                    np.nan)
+                with self._stage('exgauss', rows=trials.n_rows):
+                    fits = _exgauss().fit_race(trials, start_SSRTs)
+                fits.index = groups.ids
+                metrics['SSRT'] = fits.pop('SSRT')
+                metrics = pd.concat([metrics, fits], axis=1)
+            else:
+                metrics['SSRT'] = np.where(
+                    valid,
+                    nrt_dict[self.model]() - metrics['mean_SSD'].values,
+                    np.nan)
+        return metrics
+
     def _calc_p_respond(self):
         """Calculate the P(repsond|signal) of a dataset."""
 
@@ -180,13 +387,385 @@ class SSRTmodel(MultiLevelComputer):
             goRTs.sort()
         return goRTs
 
-    def _get_nth_RT(self, P_respond, goRTs):
-        """Get nth RT based P(response|signal) and sorted go RTs."""
-        nth_index = int(np.rint(P_respond*len(goRTs))) - 1
-        if nth_index < 0:
-            nth_RT = goRTs[0]
-        elif nth_index >= len(goRTs):
-            nth_RT = goRTs[-1]
+
+class OnlineSSRTmodel(Computer):
+    """SSRT and related metrics of an individual, updated trial by trial.
+
+    Running counts and moments are kept alongside an order-statistics
+    structure over go RTs, so each update and each query is O(log n).
+    Results match SSRTmodel fit on the same trials.
+    """
+    def __init__(self, model='replacement', max_RT=None):
+        assert model in ['replacement', 'omission',
+                         'integration', 'mean', 'all']
+        super().__init__()
+        self.model = model
+        self.max_RT = max_RT
+        self._state = None
+        self._max_goRT = np.nan
+
+    def fit(self, data_df):
+        """Reset, then update with every trial of an individual."""
+        self._state = None
+        self._max_goRT = np.nan
+        self._start_profile()
+        with self._stage('fit', rows=len(data_df)):
+            return self.partial_fit(data_df)
+
+    def partial_fit(self, trial):
+        """Update with one trial (a dict or series in the standard schema),
+        or with every row of a dataframe, in order."""
+        if self._state is None:
+            self._state = _RunningSSRT()
+        trial = self._as_frame(trial)
+        if isinstance(trial, pd.core.frame.DataFrame):
+            assert self._is_preprocessed(trial)
+            acc = as_float(trial['choice_accuracy']) \
+                if 'choice_accuracy' in trial.columns else None
+            rows = zip(trial['condition'].values, as_float(trial['goRT']),
+                       as_float(trial['stopRT']), as_float(trial['SSD']),
+                       acc if acc is not None else [None] * len(trial))
+            for condition, goRT, stopRT, SSD, trial_acc in rows:
+                self._update(condition, goRT, stopRT, SSD, trial_acc)
+        else:
+            assert 'condition' in trial, 'missing condition from trial'
+            self._update(trial['condition'],
+                         _trial_value(trial, 'goRT'),
+                         _trial_value(trial, 'stopRT'),
+                         _trial_value(trial, 'SSD'),
+                         _trial_value(trial, 'choice_accuracy')
+                         if 'choice_accuracy' in trial else None)
+        return self
+
+    def transform(self):
+        try:
+            assert self._state is not None
+        except AssertionError:
+            raise not_fitted_error(
+                'Model must first be fitted using .fit() or .partial_fit()')
+        max_RT = self.max_RT if self.max_RT is not None else self._max_goRT
+        self._transformed_data = self._state.metrics(self.model, max_RT)
+        return self._transformed_data
+
+    def fit_transform(self, data_df):
+        self.fit(data_df)
+        return self.transform()
+
+    def _update(self, condition, goRT, stopRT, SSD, acc):
+        # NaN until the first go RT, like the max of the goRT column
+        if goRT == goRT and not self._max_goRT >= goRT:
+            self._max_goRT = goRT
+        self._state.add(condition, goRT, stopRT, SSD, acc)
+
+
+class WindowedSSRTmodel(MultiLevelComputer):
+    """SSRT and related metrics over rolling windows of trials, or per block.
+
+    Each subject's trials are swept once, adding the trials that enter a
+    window and removing those that leave it, so a subject costs
+    O(n log window) rather than a refit per window. Windows hold `window`
+    consecutive trials and start every `step` trials; with window=None,
+    each block is fit separately.
+    """
+    def __init__(self, model='replacement', window=None, step=1):
+        assert model in ['replacement', 'omission',
+                         'integration', 'mean', 'all']
+        assert window is None or window > 0
+        assert step > 0
+        super().__init__()
+        self.model = model
+        self.window = window
+        self.step = step
+
+    def _fit_individual(self, data_df, max_RT=None):
+        """Get the metrics of each window, indexed by window or block."""
+        assert self._is_preprocessed(data_df)
+        self._raw_data = data_df
+        with self._stage('trial_arrays', rows=len(data_df)):
+            trials = TrialArrays(data_df, level='individual')
+        self._transformed_data = self._calc_windows(
+            data_df, trials, max_RT).droplevel('ID')
+        return self
+
+    def _fit_group(self, data_df, max_RT=None):
+        """Get the metrics of each window, indexed by ID and window or
+        block, replacing omissions with the group's slowest go RT by
+        default, as SSRTmodel does."""
+        assert self._is_preprocessed(data_df)
+        self._raw_data = data_df
+        max_RT = self._get_group_kwargs(data_df, max_RT=max_RT)['max_RT']
+        with self._stage('trial_arrays', rows=len(data_df)):
+            trials = TrialArrays(data_df)
+        self._transformed_data = self._calc_windows(data_df, trials, max_RT)
+
+    def _get_group_kwargs(self, data_df, max_RT=None):
+        """Share the group's max RT with every shard."""
+        if max_RT is None:
+            max_RT = data_df['goRT'].max()
+        return {'max_RT': max_RT}
+
+    def _calc_windows(self, data_df, trials, max_RT):
+        """Sweep each subject's trials, collecting one row per window."""
+        conditions = np.where(trials.is_go, 'go',
+                              np.where(trials.is_stop, 'stop', ''))
+        accs = trials.acc if trials.acc is not None \
+            else np.full(trials.n_rows, None)
+        all_trials = list(zip(conditions, trials.goRT, trials.stopRT,
+                              trials.SSD, accs))
+        blocks = np.asarray(data_df['block'])[trials.order]
+
+        index, records = [], []
+        with self._stage('windows', rows=trials.n_rows):
+            for sub_id, rows in zip(trials.groups.ids,
+                                    trials.subject_slices()):
+                sub_trials = all_trials[rows]
+                windows = self._sweep_blocks(sub_trials, blocks[rows]) \
+                    if self.window is None \
+                    else self._sweep_windows(sub_trials)
+                for label, state in windows:
+                    index.append((sub_id, label))
+                    records.append(self._get_record(state, max_RT))
+        level_name = 'block' if self.window is None else 'window'
+        return pd.DataFrame(
+            records, index=pd.MultiIndex.from_tuples(
+                index, names=['ID', level_name]))
+
+    def _sweep_windows(self, sub_trials):
+        """Yield each full window, labelled by its first trial."""
+        state = _RunningSSRT()
+        n_trials = len(sub_trials)
+        start, stop = 0, 0
+        for new_start in range(0, n_trials - self.window + 1, self.step):
+            new_stop = new_start + self.window
+            if new_start >= stop:
+                # no overlap with the previous window
+                state = _RunningSSRT()
+                start = stop = new_start
+            for trial in sub_trials[start:new_start]:
+                state.remove(*trial)
+            for trial in sub_trials[stop:new_stop]:
+                state.add(*trial)
+            start, stop = new_start, new_stop
+            yield new_start, state
+
+    def _sweep_blocks(self, sub_trials, sub_blocks):
+        """Yield each block, in order of appearance."""
+        codes, uniques = pd.factorize(sub_blocks)
+        # one stable sort groups each block's trials, in trial order
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        for code, block in enumerate(uniques):
+            state = _RunningSSRT()
+            for trial_idx in order[bounds[code]:bounds[code + 1]]:
+                state.add(*sub_trials[trial_idx])
+            yield block, state
+
+    def _get_record(self, state, max_RT):
+        """Get a window's metrics as one flat row."""
+        if max_RT is None:
+            # each window's slowest go RT, as when fitting it alone
+            max_RT = state.goRTs.nth(len(state.goRTs) - 1) \
+                if len(state.goRTs) > 0 else np.nan
+        metrics = state.metrics(self.model, max_RT)
+        if self.model != 'all':
+            return metrics
+        SSRTs = metrics.pop('SSRT')
+        record = {'SSRT_{}'.format(method): np.nan if SSRTs is None
+                  else SSRTs[method]
+                  for method in ['mean', 'integration', 'omission',
+                                 'replacement']}
+        record.update(metrics)
+        return record
+
+
+class _RunningMoments:
+    """Count, mean and sum of squared deviations, by Welford's method."""
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        if self.n == 1:
+            self.__init__()
+            return
+        self.n -= 1
+        delta = value - self.mean
+        self.mean -= delta / self.n
+        self.m2 -= delta * (value - self.mean)
+
+    def get_mean(self):
+        return self.mean if self.n > 0 else np.nan
+
+    def get_std(self, ddof=0):
+        if self.n <= ddof:
+            return np.nan
+        return np.sqrt(max(self.m2, 0.) / (self.n - ddof))
+
+
+class _RunningSSRT:
+    """Counts, moments and ordered go RTs of a set of trials, which
+    trials can be added to and removed from."""
+    def __init__(self):
+        self.n_go = 0
+        self.n_stop = 0
+        self.n_stopfail = 0
+        self.goRTs = OrderStatistics()
+        self.go_moments = _RunningMoments()
+        self.stopfail_moments = _RunningMoments()
+        self.SSD_moments = _RunningMoments()
+        self.go_acc = _RunningMoments()
+        self.stopfail_acc = _RunningMoments()
+        self.n_acc = 0
+
+    def add(self, condition, goRT, stopRT, SSD, acc=None):
+        """Add a trial; NaN marks a missing RT or SSD, and acc is None
+        when there is no choice accuracy column."""
+        self._update(condition, goRT, stopRT, SSD, acc, 1)
+
+    def remove(self, condition, goRT, stopRT, SSD, acc=None):
+        """Remove a previously added trial."""
+        self._update(condition, goRT, stopRT, SSD, acc, -1)
+
+    def _update(self, condition, goRT, stopRT, SSD, acc, sign):
+        adding = sign > 0
+        if acc is not None:
+            self.n_acc += sign
+        if SSD == SSD:
+            _move(self.SSD_moments, SSD, adding)
+        if condition == 'go':
+            self.n_go += sign
+            if goRT == goRT:
+                if adding:
+                    self.goRTs.add(goRT)
+                else:
+                    self.goRTs.remove(goRT)
+                _move(self.go_moments, goRT, adding)
+                if acc is not None and acc == acc:
+                    _move(self.go_acc, acc, adding)
+        elif condition == 'stop':
+            self.n_stop += sign
+            if stopRT == stopRT:
+                self.n_stopfail += sign
+                _move(self.stopfail_moments, stopRT, adding)
+                if acc is not None and acc == acc:
+                    _move(self.stopfail_acc, acc, adding)
+
+    def metrics(self, model, max_RT):
+        """Get the metrics of SSRTmodel for the current trials."""
+        n_RTs = len(self.goRTs)
+        metrics = {
+            'SSRT': None,
+            'mean_SSD': self.SSD_moments.get_mean(),
+            'p_respond': self.n_stopfail / self.n_stop
+            if self.n_stop > 0 else None,
+            'max_RT': max_RT,
+            'mean_go_RT': self.go_moments.get_mean() if n_RTs > 0 else None,
+            'sd_go_RT': self.go_moments.get_std() if n_RTs > 0 else None,
+            'mean_stopfail_RT': self.stopfail_moments.get_mean()
+            if self.n_stopfail > 0 else None,
+            'sd_stopfail_RT': self.stopfail_moments.get_std(ddof=1)
+            if self.n_stopfail > 0 else None,
+            'omission_count': self.n_go - n_RTs,
+            'omission_rate': (self.n_go - n_RTs) / self.n_go
+            if self.n_go > 0 else None,
+            'go_acc': self.go_acc.get_mean() if self.n_acc > 0 else None,
+            'stopfail_acc': self.stopfail_acc.get_mean()
+            if self.n_acc > 0 else None,
+        }
+        P_respond = metrics['p_respond']
+        if P_respond is None or not 0 < P_respond < 1 or n_RTs == 0:
+            return metrics
+
+        omission_count = metrics['omission_count']
+        nrt_dict = {
+            'mean': lambda: metrics['mean_go_RT'],
+            'integration': lambda: self.goRTs.nth(
+                int(nth_index(P_respond, n_RTs))),
+            'omission': lambda: self.goRTs.nth(int(nth_index(
+                P_respond/(1-metrics['omission_rate']), n_RTs))),
+            'replacement': lambda: self._replacement_RT(
+                int(nth_index(P_respond, n_RTs + omission_count)), max_RT),
+        }
+        if model == 'all':
+            metrics['SSRT'] = {k: func() - metrics['mean_SSD']
+                               for k, func in nrt_dict.items()}
+        else:
+            metrics['SSRT'] = nrt_dict[model]() - metrics['mean_SSD']
+        return metrics
+
+    def _replacement_RT(self, nth, max_RT):
+        # omissions are replaced by max_RT, after the sorted go RTs
+        if nth < len(self.goRTs):
+            return self.goRTs.nth(nth)
+        return max_RT
+
+
+def _move(moments, value, adding):
+    if adding:
+        moments.add(value)
+    else:
+        moments.remove(value)
+
+
+def _trial_value(trial, key):
+    """Get a trial's value as a float, with None or absent as NaN."""
+    value = trial.get(key)
+    return np.nan if value is None else float(value)
+
+
+def _bootstrap_SSRTs(goRTs, stop_fails, SSDs, max_RT, seed, n_resamples,
+                     methods):
+    """Get n_resamples bootstrapped SSRTs for one subject.
+
+    goRTs has NaN for go omissions; stop_fails and SSDs hold one value
+    per stop trial. Go trials are resampled as ranks into the sorted go
+    RTs, so sorting each resample's small integer ranks yields its
+    order statistics.
+    """
+    n_go, n_stop = len(goRTs), len(stop_fails)
+    if n_go == 0 or n_stop == 0:
+        return {method: np.full(n_resamples, np.nan) for method in methods}
+    rng = np.random.default_rng(seed)
+    # omissions (NaN) sort last, after the n_valid go RTs
+    sorted_RTs = np.sort(goRTs)
+    n_valid = int(np.sum(~np.isnan(sorted_RTs)))
+    rank_dtype = np.int16 if n_go <= np.iinfo(np.int16).max else np.int64
+    ranks = rng.integers(0, n_go, size=(n_resamples, n_go), dtype=rank_dtype)
+    ranks.sort(axis=1)
+    stop_idx = rng.integers(0, n_stop, size=(n_resamples, n_stop))
+
+    p_respond = stop_fails[stop_idx].mean(axis=1)
+    n_resp = (ranks < n_valid).sum(axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        mean_SSD = np.nanmean(SSDs[stop_idx], axis=1)
+        omission_rate = (n_go - n_resp) / n_go
+        nth_dict = {
+            'integration': nth_index(p_respond, n_resp),
+            'omission': nth_index(p_respond / (1 - omission_rate), n_resp),
+            'replacement': nth_index(p_respond, n_go),
+        }
+
+    rows = np.arange(n_resamples)
+    SSRTs = {}
+    valid = (p_respond > 0) & (p_respond < 1)
+    for method in methods:
+        if method == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                nth_RT = np.nan_to_num(sorted_RTs)[ranks].sum(axis=1) / \
+                    n_resp
+        elif method == 'replacement':
+            nth = nth_dict[method]
+            nth_RT = np.where(nth < n_resp, sorted_RTs[ranks[rows, nth]],
+                              max_RT)
         else:
-            nth_RT = goRTs[nth_index]
-        return nth_RT
+            nth_RT = sorted_RTs[ranks[rows, nth_dict[method]]]
+        SSRTs[method] = np.where(valid, nth_RT - mean_SSD, np.nan)
+    return SSRTs
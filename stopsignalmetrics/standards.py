@@ -0,0 +1,61 @@
+import json
+import os
+from functools import lru_cache
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SOURCES = ['mturk', 'inlab']
+LEVELS = ['group', 'individual']
+
+
+class ReadOnlyDict(dict):
+    """A dict that cannot be modified, shared by every computer."""
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('{} is read-only'.format(type(self).__name__))
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (ReadOnlyDict, (dict(self),))
+
+
+def resource_path(filename):
+    """Get the path of a file in the package's data directory."""
+    return os.path.join(DATA_DIR, filename)
+
+
+def var_dict_path(source):
+    """Get the path of a bundled source's variable dict."""
+    return resource_path('{}.json'.format(source))
+
+
+def data_path(source, level):
+    """Get the path of a bundled source's CSV at some level."""
+    return resource_path('{}_{}.csv'.format(source, level))
+
+
+@lru_cache(maxsize=None)
+def get_standards():
+    """Get the standard columns and key codes, read once per process."""
+    return _read_json(resource_path('standards.json'))
+
+
+@lru_cache(maxsize=None)
+def get_var_dict(source):
+    """Get a bundled source's variable dict, read once per process."""
+    assert source in SOURCES
+    return _read_json(var_dict_path(source))
+
+
+def _read_json(filepath):
+    with open(filepath) as json_file:
+        return _freeze(json.load(json_file))
+
+
+def _freeze(obj):
+    if isinstance(obj, dict):
+        return ReadOnlyDict((key, _freeze(value))
+                            for key, value in obj.items())
+    if isinstance(obj, list):
+        return tuple(_freeze(value) for value in obj)
+    return obj
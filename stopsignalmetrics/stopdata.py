@@ -1,7 +1,9 @@
-import json
 import numpy as np
 import pandas as pd
-from .base import Computer, JSON_DICT, CSV_DICT
+from .base import Computer, _forget_validated
+from .standards import get_standards, get_var_dict, data_path
+from .cache import DataCache, DEFAULT_MAX_BYTES, file_fingerprint, make_key
+from .arrowio import read_parquet
 
 
 class StopData(Computer):
@@ -11,70 +13,187 @@ class StopData(Computer):
         self.reset(var_dict=var_dict, compute_acc_col=compute_acc_col)
 
     def reset(self, var_dict=None, compute_acc_col=True):
+        # keep profiling on across resets, e.g. by load
+        profile = getattr(self, '_profile', None)
         super().__init__()
+        self._profile = profile
         self._add_var_dict(var_dict)
         self._compute_acc_col = compute_acc_col
 
     def fit(self, data_df):
+        data_df = self._as_frame(data_df)
         assert isinstance(data_df, pd.core.frame.DataFrame),\
             'data must be in the form of a pandas dataframe.'
-        self._raw_data = data_df.copy()
-        assert self._check_variables_in_raw_data()
-        self._map_raw_data_to_standard()
+        self._start_profile()
+        with self._stage('fit', rows=len(data_df)):
+            self._raw_data = self._copy(data_df)
+            with self._stage('check_raw', rows=len(data_df)):
+                assert self._check_variables_in_raw_data()
+            self._map_raw_data_to_standard()
+        self._release()
         return self
 
-    def load(self, source='', level='', return_clean=True):
-        raw_data, var_dict = self._read_data_and_var_dict(
-            source=source, level=level)
-        self.reset(var_dict=var_dict, compute_acc_col=self._compute_acc_col)
-        self.fit(raw_data)
+    def load(self, source='', level='', return_clean=True, cache=False,
+             cache_dir=None):
+        assert source in ['mturk', 'inlab']
+        assert level in ['group', 'individual']
+        self.reset(var_dict=get_var_dict(source),
+                   compute_acc_col=self._compute_acc_col)
         if return_clean:
-            return self.transform()
+            return self.load_csv(data_path(source, level), cache=cache,
+                                 cache_dir=cache_dir)
+        raw_df = pd.read_csv(data_path(source, level))
+        self.fit(raw_df)
+        return raw_df, self._variable_dict
+
+    def load_csv(self, filepath, cache=False, cache_dir=None,
+                 max_cache_bytes=DEFAULT_MAX_BYTES, **read_csv_kwargs):
+        """Read and standardize a CSV, optionally through an on-disk cache.
+
+        Cached data is keyed by the file's path, size and modification
+        time, the var_dict, compute_acc_col and any read_csv arguments,
+        and numeric columns are memory-mapped when read back.
+        """
+        if not cache:
+            return self.fit(pd.read_csv(filepath, **read_csv_kwargs))\
+                .transform()
+        data_cache = DataCache(cache_dir, max_bytes=max_cache_bytes)
+        key = make_key(file_fingerprint(filepath), self._variable_dict,
+                       self._compute_acc_col, read_csv_kwargs)
+        data_df = data_cache.get(key)
+        if data_df is None:
+            data_df = self.fit(pd.read_csv(filepath, **read_csv_kwargs))\
+                .transform()
+            data_cache.put(key, data_df)
         else:
-            return self._raw_data, var_dict
+            # the raw csv is not read on a cache hit
+            self._raw_data = data_df
+            self._transformed_data = data_df
+        return data_df
+
+    def load_parquet(self, filepath, IDs=None, extra_columns=()):
+        """Read and standardize a Parquet file.
+
+        Only the columns mapped to the standard, plus any extra_columns,
+        are read. With IDs, only those subjects are read, and row groups
+        of other subjects are skipped.
+        """
+        columns = list(self._map_cols.values()) + \
+            [col for col in extra_columns
+             if col not in self._map_cols.values()]
+        return self.fit(read_parquet(filepath, columns=columns, IDs=IDs,
+                                     id_column=self._map_cols['ID']))\
+            .transform()
+
+    def stream(self, filepath, chunksize=100000, **read_csv_kwargs):
+        """Yield (ID, standardized data) per subject from a CSV in chunks.
+
+        Each subject's rows must be contiguous in the file. Rows without
+        an ID are kept, as in load_csv, and yielded under a NaN ID from
+        each chunk that has them. Memory is bounded by the chunk size
+        plus the rows of the subject spanning a chunk boundary.
+        """
+        id_col = self._map_cols['ID']
+        seen_IDs = set()
+        condition_codes = set()
+        carry = None
+        for chunk in pd.read_csv(filepath, chunksize=chunksize,
+                                 **read_csv_kwargs):
+            assert id_col in chunk.columns,\
+                'missing {} from raw data df columns'.format(id_col)
+            if carry is not None:
+                chunk = pd.concat([carry, chunk])
+            # hold back the rows after any other subject's last row, as the
+            # last subject may continue in the next chunk
+            ids = chunk[id_col].values
+            has_id = np.flatnonzero(pd.notnull(ids))
+            split = len(ids)
+            if len(has_id):
+                other_rows = has_id[ids[has_id] != ids[has_id[-1]]]
+                split = other_rows[-1] + 1 if len(other_rows) else 0
+            carry = chunk.iloc[split:]
+            for out in self._stream_chunk(chunk.iloc[:split], seen_IDs,
+                                          condition_codes):
+                yield out
+        if carry is not None:
+            for out in self._stream_chunk(carry, seen_IDs, condition_codes):
+                yield out
+
+        for cond in ['go', 'stop']:
+            assert self._map_codes[cond] in condition_codes,\
+                ('missing {} from column: '.format(self._map_codes[cond]),
+                 self._map_cols["condition"])
+
+    def stream_to_csv(self, filepath, out_path, chunksize=100000,
+                      **read_csv_kwargs):
+        """Standardize a CSV in chunks, writing the result to out_path."""
+        IDs = []
+        for sub_id, sub_df in self.stream(filepath, chunksize=chunksize,
+                                          **read_csv_kwargs):
+            sub_df.to_csv(out_path, mode='a' if IDs else 'w',
+                          header=not IDs, index=False)
+            IDs.append(sub_id)
+        return IDs
 
     # private functions
+    def _stream_chunk(self, chunk, seen_IDs, condition_codes):
+        """Standardize one chunk and split it into subjects."""
+        if len(chunk) == 0:
+            return
+        condition_codes.update(chunk[self._map_cols['condition']].unique())
+        assert self._check_variables_in_raw_data(chunk,
+                                                 check_conditions=False)
+        data_df = self._map_to_standard(chunk.copy())
+        missing_ID = data_df[self._cols['ID']].isnull().values
+        if missing_ID.any():
+            yield np.nan, data_df[missing_ID].reset_index(drop=True)
+            data_df = data_df[~missing_ID]
+        for sub_id, sub_df in data_df.groupby(self._cols['ID'], sort=False):
+            assert sub_id not in seen_IDs,\
+                'rows for {} are not contiguous in the file.'.format(sub_id)
+            seen_IDs.add(sub_id)
+            yield sub_id, sub_df.reset_index(drop=True)
+
     def _add_var_dict(self, var_dict=None):
         """Save passed in variables for mapping to standard."""
         # add variable dictionaries, supplementing anything missing
-        # with the standards defined in the json
-        standards = self._load_json()
-        if var_dict is None:
-            var_dict = standards
-        else:
-            for level in standards.keys():
-                if level not in var_dict.keys():
-                    var_dict[level] = standards[level].copy()
-                else:
-                    for key in standards[level].keys():
-                        if key not in var_dict[level].keys():
-                            var_dict[level][key] = standards[level][key]
+        # with the standards, without modifying the passed in dict
+        standards = get_standards()
+        var_dict = {} if var_dict is None else \
+            {level: dict(values) for level, values in var_dict.items()}
+        for level in standards.keys():
+            var_dict[level] = dict(standards[level],
+                                   **var_dict.get(level, {}))
         self._map_cols = var_dict['columns']
         self._map_codes = var_dict['key_codes']
         self._variable_dict = var_dict
         self._standards = standards
 
-    def _check_variables_in_raw_data(self):
+    def _check_variables_in_raw_data(self, data_df=None,
+                                     check_conditions=True):
         """Make sure a mapping is possible."""
+        if data_df is None:
+            data_df = self._raw_data
         # make sure that all of the necessary variables are present
         # or mapped via the variable dict
         for key in [key for key in self._map_cols.keys()
                     if key not in ['block', 'choice_accuracy', 'ID']]:
-            assert self._map_cols[key] in self._raw_data.columns,\
+            assert self._map_cols[key] in data_df.columns,\
                  'missing {} from raw data df columns'.format(
                     self._map_cols[key])
 
-        condition_codes = self._raw_data[self._map_cols['condition']].unique()
-        for cond in ['go', 'stop']:
-            assert self._map_codes[cond] in condition_codes,\
-                ('missing {} from column: '.format(self._map_codes[cond]),
-                 self._map_cols["condition"])
+        if check_conditions:
+            condition_codes = data_df[self._map_cols['condition']].unique()
+            for cond in ['go', 'stop']:
+                assert self._map_codes[cond] in condition_codes,\
+                    ('missing {} from column: '.format(self._map_codes[cond]),
+                     self._map_cols["condition"])
 
         # check that all unique non-nan values in the accuracy column 
         # can be mapped onto either correct or incorrect,
         # as defined by the values in the var_dict.
-        if self._map_cols['choice_accuracy'] in self._raw_data.columns:
-            raw_acc_codes = self._raw_data[
+        if self._map_cols['choice_accuracy'] in data_df.columns:
+            raw_acc_codes = data_df[
                 self._map_cols['choice_accuracy']].unique()
             raw_acc_codes = [i for i in raw_acc_codes if i==i]
             map_acc_codes = [self._map_codes['correct'],
@@ -89,54 +208,58 @@ class StopData(Computer):
 
     def _map_raw_data_to_standard(self):
         """Map data to standard."""
-        data_df = self._raw_data.copy()
+        # columns are replaced rather than modified when mapping, so in
+        # zero-copy mode a shallow copy keeps the raw data untouched
+        data_df = self._raw_data.copy(deep=False) if self._zero_copy \
+            else self._copy(self._raw_data)
+        with self._stage('map', rows=len(data_df)):
+            self._transformed_data = self._map_to_standard(data_df)
+
+    def _map_to_standard(self, data_df):
+        """Map a frame to standard, modifying it in place."""
+        condition = data_df[self._map_cols['condition']].values
+        is_go = condition == self._map_codes['go']
+        is_stop = condition == self._map_codes['stop']
 
         # if only 1 RT col, split into 2
         if self._map_cols['goRT'] == self._map_cols['stopRT']:
+            RTs = self._to_float_RTs(data_df[self._map_cols['goRT']])
+            del data_df[self._map_cols['goRT']]
             data_df[self._standards['columns']['goRT']] = np.where(
-                data_df[self._map_cols['condition']] == self._map_codes['go'],
-                data_df[self._map_cols['goRT']],
-                None)
+                is_go, RTs, np.nan)
             data_df[self._standards['columns']['stopRT']] = np.where(
-                data_df[self._map_cols['condition']] ==
-                self._map_codes['stop'],
-                data_df[self._map_cols['stopRT']],
-                None)
-            del data_df[self._map_cols['goRT']]
+                is_stop, RTs, np.nan)
         else:
-            data_df.loc[
-                data_df[self._map_cols['condition']] !=
-                self._map_codes['go'],
-                self._map_cols['goRT']] = None
-            data_df.loc[
-                data_df[self._map_cols['condition']] !=
-                self._map_codes['stop'],
-                self._map_cols['stopRT']] = None
-
-        # drop SSDs of non-stop Trials
-        data_df.loc[
-            data_df[self._map_cols['condition']] != self._map_codes['stop'],
-            self._map_cols['SSD']] = None
+            for col, keep in [('goRT', is_go), ('stopRT', is_stop)]:
+                RTs = self._to_float_RTs(data_df[self._map_cols[col]])
+                data_df[self._map_cols[col]] = np.where(keep, RTs, np.nan)
+
+        # drop SSDs of non-stop Trials, reading non-numeric SSDs as NaN
+        data_df[self._map_cols['SSD']] = np.where(
+            is_stop,
+            pd.to_numeric(data_df[self._map_cols['SSD']].values,
+                          errors='coerce').astype(float),
+            np.nan)
 
         # add block column if not present
         if self._map_cols['block'] not in data_df.columns:
             data_df[self._map_cols['block']] = 1
 
         # recompute choice accuracy if missing / flagged
-        if (self._map_cols['choice_accuracy'] not in self._raw_data.columns) |\
+        if (self._map_cols['choice_accuracy'] not in data_df.columns) |\
                 self._compute_acc_col:
             corr_code = self._map_codes['correct']
             incorr_code = self._map_codes['incorrect']
             data_df[self._map_cols['choice_accuracy']] = np.where(
-                data_df[self._map_cols['response']] == data_df[
-                    self._map_cols['correct_response']],
+                data_df[self._map_cols['response']].values == data_df[
+                    self._map_cols['correct_response']].values,
                 corr_code,
                 incorr_code)
 
         # map columns, key codes to standard
         rename_column_dict = {self._map_cols[col]: self._standards['columns']
                               [col] for col in self._map_cols.keys()}
-        data_df = data_df.rename(columns=rename_column_dict)
+        data_df = data_df.rename(columns=rename_column_dict, copy=False)
 
         # map key codes to various columns
         condition_map = {
@@ -147,22 +270,31 @@ class StopData(Computer):
             self._map_codes['correct']: self._standards['key_codes']['correct'],
             self._map_codes['incorrect']: self._standards['key_codes']['incorrect'],
         }
-        no_response_map = {
-            self._map_codes['noResponse']: self._standards['key_codes']['noResponse']
-        }
         cols_n_maps = [(self._standards['columns']['condition'], condition_map),
-                    (self._standards['columns']['choice_accuracy'], acc_map),
-                    (self._standards['columns']['goRT'], no_response_map),
-                    (self._standards['columns']['stopRT'], no_response_map)]
+                       (self._standards['columns']['choice_accuracy'], acc_map)]
         for col, map_dict in cols_n_maps:
-            data_df[col] = data_df[col].map(lambda x: map_dict.get(x,x))
+            if any(k != v for k, v in map_dict.items()):
+                data_df[col] = self._translate_codes(data_df[col], map_dict)
 
+        # accuracy codes were written above, so check them again
+        _forget_validated(data_df)
         assert self._is_preprocessed(data_df)
-        self._transformed_data = data_df
+        return data_df
 
-    def _read_data_and_var_dict(self, source='', level=''):
-        assert source in ['mturk', 'inlab']
-        assert level in ['group', 'individual']
-        var_dict = self._load_json(filepath=JSON_DICT[source])
-        data = pd.read_csv(CSV_DICT[source][level])
-        return data, var_dict
+    def _to_float_RTs(self, col):
+        """Get RTs as floats, with no-response codes and any other
+        non-numeric values (e.g. blank or 'NA' strings) as NaN."""
+        no_response = self._map_codes['noResponse']
+        values = col.values
+        if no_response is not None and no_response == no_response:
+            values = np.where(values == no_response, np.nan, values)
+        return pd.to_numeric(values, errors='coerce').astype(float)
+
+    def _translate_codes(self, col, map_dict):
+        """Map codes via the column's unique values, not row by row."""
+        codes, uniques = pd.factorize(col)
+        mapped_uniques = [map_dict.get(x, x) for x in uniques] + [np.nan]
+        mapped = np.empty(len(mapped_uniques), dtype=object)
+        mapped[:] = mapped_uniques
+        return pd.Series(mapped[codes], index=col.index,
+                         name=col.name).infer_objects()
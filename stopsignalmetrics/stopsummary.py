@@ -1,8 +1,8 @@
-import json
-import pandas as pd
-from .base import MultiLevelComputer, STANDARDS_FILE
+import numpy as np
+from .base import MultiLevelComputer
 from .ssrtmodel import SSRTmodel
 from .sequence import PostStopSlow, Violations
+from .grouping import TrialArrays
 
 
 class StopSummary(MultiLevelComputer):
@@ -30,38 +30,44 @@ class StopSummary(MultiLevelComputer):
             'violations_verbose': violations_verbose
         }
 
-        with open(STANDARDS_FILE) as json_file:
-            standards = json.load(json_file)
-        self._cols = standards['columns']
-        self._codes = standards['key_codes']
-
     def _fit_individual(self, data_df):
         """Calculate all available metrics for an individual."""
-        self._raw_data = data_df.copy()
-        metrics = self._SSRTmodel.fit_transform(self._raw_data).copy()
-        metrics['post_stop_slow'] = self._get_mean_pss()
-        metrics['post_stop_success_slow'] = self._get_mean_pss(
-            stop_type='success')
-        metrics['post_stop_fail_slow'] = self._get_mean_pss(
-            stop_type='fail')
-        metrics['mean_violation'] = self._Violations.fit(
-            self._raw_data).get_mean_below_thresh()
-        self._transformed_data = metrics.copy()
+        assert self._is_preprocessed(data_df)
+        self._raw_data = data_df
+        with self._stage('trial_arrays', rows=len(data_df)):
+            trials = TrialArrays(data_df, level='individual')
+        metrics = self._calc_metrics(trials)
+        indiv_metrics = {col: metrics[col].iloc[0] for col in metrics.columns}
+        if self._SSRTmodel.model == 'all':
+            ssrt_cols = [col for col in metrics.columns
+                         if col.startswith('SSRT_')]
+            indiv_metrics = dict(
+                [('SSRT', {col[len('SSRT_'):]: indiv_metrics.pop(col)
+                           for col in ssrt_cols})] +
+                list(indiv_metrics.items()))
+        self._transformed_data = indiv_metrics
 
     def _fit_group(self, data_df):
         """Calculate all available metrics for a group."""
-        self._raw_data = data_df.copy()
-        summary_helper = StopSummary(**self.args)
-        metrics = self._raw_data.groupby('ID').apply(
-            summary_helper.fit_transform).apply(pd.Series)
-        if self._SSRTmodel.model == 'all':
-            metrics = pd.concat([metrics['SSRT'].apply(
-                pd.Series).add_prefix('SSRT_'), metrics],
-                1)
-            del metrics['SSRT']
-        self._transformed_data = metrics.copy()
+        assert self._is_preprocessed(data_df)
+        self._raw_data = data_df
+        with self._stage('trial_arrays', rows=len(data_df)):
+            trials = TrialArrays(data_df)
+        self._transformed_data = self._calc_metrics(trials)
 
-    def _get_mean_pss(self, stop_type='all'):
-        """Get a subject's mean PSS, after fitting to a stop type."""
-        return self._PostStopSlow.fit(self._raw_data,
-                                      stop_type=stop_type).get_mean_pss()
+    def _calc_metrics(self, trials):
+        """Derive every metric from one shared set of trial arrays."""
+        with self._stage('ssrt', rows=trials.n_rows):
+            subject_max_RT = trials.groups.max(trials.goRT,
+                                               ~np.isnan(trials.goRT))
+            metrics = self._SSRTmodel._calc_group_metrics(trials,
+                                                          subject_max_RT)
+        with self._stage('pss', rows=trials.n_rows):
+            mean_pss = self._PostStopSlow._calc_group_pss(trials)
+            metrics['post_stop_slow'] = mean_pss['all']
+            metrics['post_stop_success_slow'] = mean_pss['success']
+            metrics['post_stop_fail_slow'] = mean_pss['fail']
+        with self._stage('violations', rows=trials.n_rows):
+            metrics['mean_violation'] = \
+                self._Violations._calc_group_mean_below_thresh(trials)
+        return metrics
@@ -0,0 +1,126 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from .cache import CACHE_VERSION, META_FILE, write_columns, open_columns,\
+    decode_column
+
+INDEX_FILE = 'index.npy'
+OFFSETS_FILE = 'offsets.npy'
+
+
+class TrialStore:
+    """Standardized trials on disk, sorted by ID, with an index of the
+    rows of each subject.
+
+    Each column is a contiguous file, memory-mapped when the store is
+    opened, so reading a subject is a constant-time slice that does not
+    copy numeric columns, and a pass over every subject reads the files
+    in order. Computers accept a TrialStore anywhere they accept a
+    standardized dataframe, and fit groups from it in slices of whole
+    subjects.
+    """
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self._mmap = mmap
+        with open(os.path.join(path, META_FILE)) as json_file:
+            self._meta = json.load(json_file)
+        assert self._meta.get('version') == CACHE_VERSION,\
+            '{} was written by another version.'.format(path)
+        self._columns = open_columns(path, self._meta, mmap=mmap)
+        self._IDs = np.load(os.path.join(path, INDEX_FILE),
+                            allow_pickle=True)
+        self._offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        self._ID_positions = {sub_id: i for i, sub_id in enumerate(self._IDs)}
+
+    @classmethod
+    def write(cls, data_df, path, mmap=True):
+        """Write a standardized frame to path, then open it.
+
+        Rows are sorted by ID, keeping their order within each subject;
+        rows without an ID are dropped.
+        """
+        assert isinstance(data_df, pd.core.frame.DataFrame),\
+            'data must be in the form of a pandas dataframe.'
+        assert 'ID' in data_df.columns, 'missing ID from data df columns'
+        codes, IDs = pd.factorize(data_df['ID'], sort=True)
+        if not (np.all(codes[1:] >= codes[:-1]) and np.all(codes >= 0)):
+            order = np.argsort(codes, kind='stable')
+            order = order[codes[order] >= 0]
+            data_df = data_df.iloc[order]
+            codes = codes[order]
+        counts = np.bincount(codes, minlength=len(IDs))
+        meta = write_columns(data_df.reset_index(drop=True), path)
+        meta['version'] = CACHE_VERSION
+        np.save(os.path.join(path, INDEX_FILE),
+                np.asarray(IDs, dtype=object), allow_pickle=True)
+        np.save(os.path.join(path, OFFSETS_FILE),
+                np.concatenate(([0], np.cumsum(counts))).astype(np.int64))
+        with open(os.path.join(path, META_FILE), 'w') as json_file:
+            json.dump(meta, json_file)
+        return cls(path, mmap=mmap)
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def __contains__(self, sub_id):
+        return sub_id in self._ID_positions
+
+    def __getitem__(self, name):
+        """Get one whole column, decoding only that column."""
+        values, uniques = self._columns[name]
+        return pd.Series(decode_column(values, uniques), name=name,
+                         copy=False)
+
+    def __getstate__(self):
+        # workers reopen the memory maps rather than being sent the data
+        return {'path': self.path, 'mmap': self._mmap}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], mmap=state['mmap'])
+
+    @property
+    def IDs(self):
+        return list(self._IDs)
+
+    @property
+    def columns(self):
+        return pd.Index(list(self._columns.keys()))
+
+    def get_rows(self, sub_id):
+        """Get the (start, stop) rows of a subject."""
+        i = self._ID_positions[sub_id]
+        return int(self._offsets[i]), int(self._offsets[i + 1])
+
+    def get_subject(self, sub_id, columns=None):
+        """Get the trials of one subject."""
+        return self.read(slice(*self.get_rows(sub_id)), columns=columns)
+
+    def iter_subjects(self, columns=None):
+        """Yield (ID, trials) for each subject, in order."""
+        for i, sub_id in enumerate(self._IDs):
+            yield sub_id, self.read(
+                slice(self._offsets[i], self._offsets[i + 1]),
+                columns=columns)
+
+    def read(self, rows=None, columns=None):
+        """Get a contiguous slice of rows, indexed by their position in
+        the store."""
+        start, stop, step = (slice(None) if rows is None else rows)\
+            .indices(len(self))
+        assert step == 1, 'rows must be a contiguous slice, without a step'
+        data_dict = {}
+        for name, (values, uniques) in self._columns.items():
+            if columns is not None and name not in columns:
+                continue
+            data_dict[name] = decode_column(values[start:stop], uniques)
+        return pd.DataFrame(data_dict, columns=list(data_dict.keys()),
+                            index=pd.RangeIndex(start, stop), copy=False)
+
+    def to_frame(self, columns=None):
+        """Get every trial."""
+        return self.read(columns=columns)
+
+    def subject_codes(self):
+        """Get the position of each row's subject in IDs."""
+        return np.repeat(np.arange(len(self._IDs)), np.diff(self._offsets))
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+from .standards import get_standards
+
+
+class TrialTable:
+    """Compact, typed trials in the standard schema.
+
+    Standard columns are stored with small dtypes; all other columns are
+    kept out-of-band in `extra` and are never passed to computers, which
+    accept a TrialTable anywhere they accept a standardized dataframe.
+    """
+    def __init__(self, data_df, float_dtype=np.float64):
+        assert isinstance(data_df, pd.core.frame.DataFrame),\
+            'data must be in the form of a pandas dataframe.'
+        std_cols = [col for col in get_standards()['columns'].values()
+                    if col in data_df.columns]
+        self.data = pd.DataFrame(
+            {col: _compact_column(data_df[col], col, float_dtype)
+             for col in std_cols},
+            index=data_df.index,
+            columns=std_cols)
+        self.extra = data_df[[col for col in data_df.columns
+                              if col not in std_cols]]
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def columns(self):
+        return self.data.columns
+
+    def to_frame(self, extra=False):
+        """Get the standard columns, optionally with the extra columns."""
+        if not extra:
+            return self.data
+        return pd.concat([self.data, self.extra], axis=1)
+
+    def memory_usage(self):
+        """Bytes used by the standard columns."""
+        return int(self.data.memory_usage(index=True, deep=True).sum())
+
+
+def _compact_column(col, name, float_dtype):
+    """Convert one standard column to its compact dtype."""
+    if name in ['SSD', 'goRT', 'stopRT']:
+        return col.astype(float_dtype)
+    if name == 'condition':
+        return pd.Categorical(col, categories=['go', 'stop'])
+    if name in ['block', 'choice_accuracy'] and \
+            pd.api.types.is_numeric_dtype(col):
+        if col.isnull().any():
+            return col.astype(np.float32)
+        return pd.to_numeric(col, downcast='integer')
+    return col.astype('category')
@@ -0,0 +1,254 @@
+"""
+tests comparing group-level fits against individual fits
+"""
+
+from stopsignalmetrics import StopData, SSRTmodel, OnlineSSRTmodel,\
+   WindowedSSRTmodel, PostStopSlow, Violations, StopSummary, TrialTable,\
+   TrialStore, InhibitionFunction
+from stopsignalmetrics import base, ssrtmodel
+from stopsignalmetrics.grouping import TrialArrays
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="session")
+def group_data():
+    return(StopData().load(source='inlab', level='group'))
+
+
+def test_ssrt_group_matches_individual(group_data):
+    group_df = SSRTmodel(model='all').fit_transform(group_data, level='group')
+    max_RT = group_data['goRT'].max()
+    for sub_id, sub_df in group_data.groupby('ID'):
+        indiv = SSRTmodel(model='all').fit_transform(sub_df, max_RT=max_RT)
+        for method, ssrt in indiv['SSRT'].items():
+            assert np.isclose(group_df.loc[sub_id, 'SSRT_' + method], ssrt)
+        for key in ['mean_SSD', 'p_respond', 'mean_go_RT', 'sd_go_RT',
+                    'sd_stopfail_RT', 'omission_count', 'go_acc']:
+            assert np.isclose(group_df.loc[sub_id, key], indiv[key])
+
+
+def test_summary_group_matches_individual_metrics(group_data):
+    summary_df = StopSummary().fit_transform(group_data, level='group')
+    for sub_id, sub_df in list(group_data.groupby('ID'))[:5]:
+        sub_df = sub_df.reset_index(drop=True)
+        for stop_type, col in [('all', 'post_stop_slow'),
+                               ('success', 'post_stop_success_slow'),
+                               ('fail', 'post_stop_fail_slow')]:
+            mean_pss = PostStopSlow().fit(
+                sub_df, stop_type=stop_type).get_mean_pss()
+            assert np.isclose(summary_df.loc[sub_id, col], mean_pss)
+        mean_violation = Violations().fit(sub_df).get_mean_below_thresh()
+        assert np.isclose(summary_df.loc[sub_id, 'mean_violation'],
+                          mean_violation, equal_nan=True)
+
+
+def test_parallel_group_fit_matches_serial(group_data):
+    for computer in [SSRTmodel, Violations]:
+        serial_df = computer().fit_transform(group_data, level='group')
+        parallel_df = computer().fit_transform(group_data, level='group',
+                                               n_jobs=2)
+        assert serial_df.equals(parallel_df)
+
+
+def test_trial_table_matches_frame(group_data):
+    trial_table = TrialTable(group_data)
+    assert trial_table.memory_usage() < \
+        group_data.memory_usage(deep=True).sum()
+    summary_df = StopSummary().fit_transform(group_data, level='group')
+    table_df = StopSummary().fit_transform(trial_table, level='group')
+    assert np.allclose(summary_df.values, table_df.values, equal_nan=True)
+
+
+def test_bootstrap_group(group_data):
+    model = SSRTmodel().fit(group_data, level='group')
+    ci_df = model.bootstrap(n_resamples=200, seed=0)
+    assert ci_df.equals(model.bootstrap(n_resamples=200, seed=0))
+    # n_jobs is read as in fit, with None meaning one process per CPU
+    assert ci_df.equals(model.bootstrap(n_resamples=200, seed=0,
+                                        n_jobs=None))
+    ssrt = model.transform()['SSRT']
+    assert ((ci_df['SSRT_lower'] <= ssrt) & (ssrt <= ci_df['SSRT_upper'])
+            ).mean() > .9
+
+
+def test_online_ssrt_matches_batch(group_data):
+    sub_df = group_data[group_data['ID'] == group_data['ID'].iloc[0]]
+    online = OnlineSSRTmodel(model='all')
+    for n_trials, (_, trial) in enumerate(sub_df.iterrows(), 1):
+        online.partial_fit(trial)
+        if n_trials % 50 == 0 or n_trials == len(sub_df):
+            batch = SSRTmodel(model='all').fit_transform(sub_df[:n_trials])
+            online_metrics = online.transform()
+            for method, ssrt in batch['SSRT'].items():
+                assert np.isclose(online_metrics['SSRT'][method], ssrt)
+            for key in ['mean_SSD', 'p_respond', 'max_RT', 'mean_go_RT',
+                        'sd_go_RT', 'sd_stopfail_RT', 'omission_rate',
+                        'go_acc', 'stopfail_acc']:
+                assert np.isclose(online_metrics[key], batch[key])
+
+
+def test_windowed_ssrt_matches_refits(group_data):
+    window_df = WindowedSSRTmodel(window=60, step=25).fit_transform(
+        group_data, level='group')
+    blocks_df = WindowedSSRTmodel().fit_transform(group_data, level='group')
+    # omissions are replaced by the group's slowest go RT, as in SSRTmodel
+    max_RT = group_data['goRT'].max()
+    for sub_id, sub_df in list(group_data.groupby('ID'))[:3]:
+        sub_df = sub_df.reset_index(drop=True)
+        for start in window_df.loc[sub_id].index[::5]:
+            refit = SSRTmodel().fit_transform(sub_df[start:start + 60],
+                                              max_RT=max_RT)
+            assert np.isclose(window_df.loc[(sub_id, start), 'SSRT'],
+                              refit['SSRT'])
+        for block, block_trials in sub_df.groupby('block'):
+            refit = SSRTmodel().fit_transform(block_trials, max_RT=max_RT)
+            assert np.isclose(blocks_df.loc[(sub_id, block), 'SSRT'],
+                              refit['SSRT'])
+    assert WindowedSSRTmodel().fit_transform(
+        group_data, level='group', n_jobs=2).equals(blocks_df)
+
+
+def test_violations_threshold_fractional_ssds(group_data):
+    shifted_data = group_data.assign(SSD=group_data['SSD'] + .5)
+    va_df = Violations().fit_transform(group_data, level='group')
+    shifted_df = Violations().fit_transform(shifted_data, level='group')
+    assert np.array_equal(va_df['SSD'] + .5, shifted_df['SSD'])
+    assert va_df.groupby('SSD').size().min() >= 5
+
+
+def test_pss_all_stop_types_in_one_fit(group_data):
+    group_pss = PostStopSlow().fit(group_data, level='group')
+    for sub_id, sub_df in list(group_data.groupby('ID'))[:3]:
+        indiv_pss = PostStopSlow().fit(sub_df)
+        for stop_type in ['all', 'success', 'fail']:
+            refit = PostStopSlow().fit(sub_df, stop_type=stop_type)
+            assert np.isclose(indiv_pss.get_mean_pss(stop_type),
+                              refit.get_mean_pss())
+            assert np.isclose(group_pss.get_mean_pss(stop_type)[sub_id],
+                              refit.get_mean_pss())
+            assert np.allclose(indiv_pss.get_diff_list(stop_type),
+                               group_pss.get_diff_list(stop_type)[sub_id])
+    parallel_pss = PostStopSlow().fit(group_data, level='group', n_jobs=2)
+    assert parallel_pss.transform().equals(group_pss.transform())
+    for stop_type in ['all', 'success', 'fail']:
+        assert parallel_pss.get_mean_pss(stop_type).equals(
+            group_pss.get_mean_pss(stop_type))
+        assert parallel_pss.get_diff_list(stop_type).equals(
+            group_pss.get_diff_list(stop_type))
+
+
+def test_profiling(group_data):
+    summary = StopSummary()
+    with pytest.raises(AssertionError):
+        summary.get_profile()
+    new_data = group_data.copy()
+    profile_df = summary.enable_profiling().fit(
+        new_data, level='group').get_profile()
+    assert list(profile_df.index) == ['validate', 'trial_arrays', 'ssrt',
+                                      'pss', 'violations', 'fit']
+    assert (profile_df['rows'] == len(group_data)).all()
+    # the frame is only validated once; later fits only look it up
+    assert summary.fit(new_data, level='group').get_profile().loc[
+        'validate', 'rows'] == 0
+    assert profile_df.loc['fit', 'wall_time_s'] >= \
+        profile_df.drop('fit')['wall_time_s'].sum()
+    parallel_df = Violations().enable_profiling().fit(
+        group_data, level='group', n_jobs=2).get_profile()
+    assert parallel_df.loc['violations', 'rows'] == len(group_data)
+
+
+def test_zero_copy(group_data, monkeypatch):
+    before = group_data.copy()
+    for computer in [SSRTmodel(), StopSummary(), PostStopSlow(),
+                     Violations()]:
+        expected = type(computer)().fit_transform(group_data, level='group')
+        computer.enable_zero_copy()
+        out = computer.fit_transform(group_data, level='group')
+        assert computer._raw_data is None
+        assert out.equals(expected)
+    # bootstrapping uses the trial arrays built by the fit, not a rebuild
+    built = []
+    monkeypatch.setattr(ssrtmodel, 'TrialArrays',
+                        lambda *args, **kwargs: built.append(1) or
+                        TrialArrays(*args, **kwargs))
+    ssrt = SSRTmodel().enable_zero_copy().fit(group_data, level='group')
+    assert len(built) == 1
+    monkeypatch.undo()
+    assert ssrt.bootstrap(n_resamples=20, seed=0).equals(
+        SSRTmodel().fit(group_data, level='group').bootstrap(
+            n_resamples=20, seed=0))
+
+    raw_df, var_dict = StopData().load(source='inlab', level='group',
+                                       return_clean=False)
+    raw_before = raw_df.copy()
+    stop_data = StopData(var_dict=var_dict).enable_zero_copy()
+    assert stop_data.fit_transform(raw_df).equals(
+        StopData(var_dict=var_dict).fit_transform(raw_df))
+    assert stop_data._raw_data is None
+    assert raw_df.equals(raw_before)
+    assert group_data.equals(before)
+
+
+def test_trial_store(group_data, tmp_path, monkeypatch):
+    # subjects out of order are sorted on writing
+    shuffled = group_data.sort_values('ID', ascending=False, kind='stable')
+    store = TrialStore.write(shuffled, str(tmp_path / 'store'))
+    assert store.IDs == sorted(group_data['ID'].unique())
+    assert len(store) == len(group_data)
+    for sub_id, sub_df in store.iter_subjects():
+        expected = shuffled[shuffled['ID'] == sub_id]
+        assert np.array_equal(sub_df['goRT'], expected['goRT'],
+                              equal_nan=True)
+        assert list(sub_df['condition']) == list(expected['condition'])
+    # reading a subject does not copy numeric columns
+    reopened = TrialStore(store.path)
+    sub_df = reopened.get_subject(store.IDs[1])
+    assert np.shares_memory(sub_df['SSD'].values,
+                            reopened._columns['SSD'][0])
+
+    with pytest.raises(AssertionError):
+        store.read(slice(0, 10, 2))
+
+    expected = SSRTmodel().fit_transform(group_data, level='group')
+    assert SSRTmodel().fit_transform(store, level='group').equals(expected)
+    assert SSRTmodel().fit_transform(store, level='group', n_jobs=2)\
+        .equals(expected)
+    # group fits read the store in slices of whole subjects, never whole
+    monkeypatch.setattr(base, 'STORE_SHARD_ROWS', len(store) // 5)
+    monkeypatch.setattr(TrialStore, 'to_frame', None)
+    ssrt = SSRTmodel().enable_profiling()
+    assert ssrt.fit_transform(store, level='group').equals(expected)
+    assert ssrt.get_profile().loc['validate', 'rows'] == len(store)
+    for computer in [StopSummary, PostStopSlow, Violations,
+                     InhibitionFunction]:
+        assert computer().fit_transform(store, level='group').equals(
+            computer().fit_transform(group_data, level='group'))
+    monkeypatch.undo()
+    assert ssrt.bootstrap(n_resamples=20, seed=0).equals(
+        SSRTmodel().fit(group_data, level='group').bootstrap(
+            n_resamples=20, seed=0))
+
+
+def test_inhibition_function(group_data):
+    stop_df = group_data[(group_data['condition'] == 'stop') &
+                         group_data['SSD'].notnull()]
+    grouped = stop_df.groupby(['ID', 'SSD'])['stopRT']
+    for model in ['logistic', 'weibull']:
+        inhibition = InhibitionFunction(model=model).fit(group_data,
+                                                         level='group')
+        table = inhibition.get_table()
+        assert (table.index == grouped.size().index).all()
+        assert (table['n_trials'] == grouped.size()).all()
+        assert np.allclose(table['p_respond'],
+                           grouped.apply(lambda RTs: RTs.notnull().mean()))
+        assert np.allclose(table['mean_stopfail_RT'], grouped.mean(),
+                           equal_nan=True)
+        curves = inhibition.transform()
+        assert (curves['slope'] > 0).all()
+        for sub_id in [1, 2]:
+            indiv = InhibitionFunction(model=model).fit(
+                group_data[group_data['ID'] == sub_id])
+            assert indiv.get_table().equals(table.loc[sub_id])
+            for key, value in indiv.transform().items():
+                assert np.isclose(value, curves.loc[sub_id, key])
@@ -0,0 +1,73 @@
+"""
+tests for grouped trial arrays and order statistics
+"""
+
+from stopsignalmetrics import SSRTmodel
+from stopsignalmetrics.grouping import nth_index, select_nth
+import numpy as np
+import pandas as pd
+
+
+def test_select_nth_matches_sort():
+    rng = np.random.default_rng(0)
+    # ties, as RTs are often recorded in whole milliseconds
+    values = rng.integers(200, 260, size=50).astype(float)
+    expected = np.sort(values)
+    for nths in [[0], [49], [3, 3, 17], [0, 25, 49], [10, 50, 75]]:
+        selected = select_nth(values, nths)
+        in_range = [nth for nth in nths if nth < len(values)]
+        assert np.array_equal(selected[in_range], expected[in_range])
+        assert np.array_equal(np.sort(selected), expected)
+    # nths past the end, e.g. in the replacement tail, select nothing
+    assert np.array_equal(select_nth(values, [50, 80]), values)
+    assert len(select_nth(np.array([]), [0, 3])) == 0
+
+
+def _make_subjects(rng, n_subjects=12, n_trials=80):
+    """Subjects with many go omissions, and one with no go RTs at all."""
+    frames = []
+    for sub_id in range(n_subjects):
+        is_stop = rng.random(n_trials) < .3
+        RTs = rng.normal(450, 80, n_trials).round()
+        omission_rate = 1. if sub_id == 0 else rng.uniform(0, .6)
+        go_RT = np.where(~is_stop & (rng.random(n_trials) >= omission_rate),
+                         RTs, np.nan)
+        stop_RT = np.where(is_stop & (rng.random(n_trials) < .5), RTs,
+                           np.nan)
+        frames.append(pd.DataFrame({
+            'ID': sub_id, 'block': 1,
+            'condition': np.where(is_stop, 'stop', 'go'),
+            'SSD': np.where(is_stop, rng.choice([150, 200, 250], n_trials),
+                            np.nan),
+            'goRT': go_RT, 'stopRT': stop_RT}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_nth_RTs_match_padded_sort():
+    data_df = _make_subjects(np.random.default_rng(1))
+    max_RT = data_df['goRT'].max()
+    group_df = SSRTmodel(model='all').fit_transform(data_df, level='group',
+                                                    max_RT=max_RT)
+    for sub_id, sub_df in data_df.groupby('ID'):
+        go_df = sub_df[sub_df['condition'] == 'go']
+        stop_df = sub_df[sub_df['condition'] == 'stop']
+        goRTs = go_df['goRT'].dropna().values
+        n_omissions = len(go_df) - len(goRTs)
+        p_respond = stop_df['stopRT'].notnull().mean()
+        mean_SSD = stop_df['SSD'].mean()
+        # the replacement method's RTs, with the tail materialized
+        padded = np.sort(np.concatenate((goRTs, [max_RT] * n_omissions)))
+        replacement = padded[nth_index(p_respond, len(padded))] - mean_SSD
+        assert np.isclose(group_df.loc[sub_id, 'SSRT_replacement'],
+                          replacement)
+        if len(goRTs):
+            integration = np.sort(goRTs)[nth_index(p_respond,
+                                                   len(goRTs))] - mean_SSD
+            assert np.isclose(group_df.loc[sub_id, 'SSRT_integration'],
+                              integration)
+            indiv = SSRTmodel(model='all').fit_transform(sub_df,
+                                                         max_RT=max_RT)
+            assert np.isclose(indiv['SSRT']['replacement'], replacement)
+            assert np.isclose(indiv['SSRT']['integration'], integration)
+        else:
+            assert np.isnan(group_df.loc[sub_id, 'SSRT_integration'])
@@ -0,0 +1,47 @@
+"""
+tests for building trial sequences
+"""
+
+from stopsignalmetrics import StopData, Sequence
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="session")
+def indiv_data():
+    return(StopData().load(source='mturk', level='individual'))
+
+
+def test_sequence_columns(indiv_data):
+    full_df = Sequence().fit_transform(indiv_data, "condition=='stop'")
+    sub_df = Sequence().fit_transform(indiv_data, "condition=='stop'",
+                                      columns=['goRT', 'stopRT'])
+    assert list(sub_df.columns) == ['trial_index', 'pre_goRT', 'pre_stopRT',
+                                    'curr_goRT', 'curr_stopRT',
+                                    'post_goRT', 'post_stopRT']
+    assert np.array_equal(full_df['trial_index'], sub_df['trial_index'])
+    assert (full_df['pre_block'] == full_df['post_block']).all()
+
+
+def test_sequence_neighbors(indiv_data):
+    seq_df = Sequence().fit_transform(indiv_data, "condition=='stop'",
+                                      columns=['goRT'])
+    for shift, pfix in [(-1, 'pre'), (1, 'post')]:
+        assert np.array_equal(
+            indiv_data.loc[seq_df['trial_index'] + shift, 'goRT'].values,
+            seq_df['{}_goRT'.format(pfix)].values,
+            equal_nan=True)
+
+
+def test_sequence_window_view(indiv_data):
+    seq_df = Sequence(window=3).fit_transform(indiv_data, "condition=='stop'",
+                                              columns=['goRT'])
+    view = Sequence(window=3, output='view').fit_transform(
+        indiv_data, "condition=='stop'", columns=['goRT'])
+    assert list(seq_df.columns) == view.keys()
+    assert 'pre3_goRT' in seq_df.columns
+    assert np.array_equal(view['post2_goRT'], seq_df['post2_goRT'],
+                          equal_nan=True)
+    windows = view.window_values('goRT')
+    assert windows.shape == (len(view), 7)
+    assert np.array_equal(windows[:, 0], seq_df['pre3_goRT'], equal_nan=True)
@@ -0,0 +1,67 @@
+"""
+tests of the simulated race model data
+"""
+
+from stopsignalmetrics import SSRTmodel, StopSummary
+from stopsignalmetrics.simulate import simulate_race, batch_SSRT,\
+    compare_SSRT_methods
+import numpy as np
+
+
+def test_simulated_data_is_standard():
+    data_df = simulate_race(n_subjects=3, n_trials=200, seed=0)
+    assert len(data_df) == 600
+    assert SSRTmodel()._is_preprocessed(data_df)
+    summary_df = StopSummary().fit_transform(data_df, level='group')
+    assert list(summary_df.index) == [1, 2, 3]
+    assert simulate_race(n_subjects=3, n_trials=200, seed=0).equals(data_df)
+
+
+def test_simulated_SSRT_is_recovered():
+    data_df, true_SSRTs = simulate_race(n_subjects=50, n_trials=1000, seed=0,
+                                        return_SSRTs=True)
+    metrics = SSRTmodel().fit_transform(data_df, level='group')
+    # the staircase tracks p_respond = .5
+    assert np.isclose(metrics['p_respond'].mean(), .5, atol=.02)
+    assert np.abs(metrics['SSRT'] - true_SSRTs).mean() < 20
+
+
+def test_batch_SSRT_matches_individual_fits():
+    data_df = simulate_race(n_subjects=10, n_trials=200, seed=1)
+    shape = (10, 200)
+    estimates = batch_SSRT((data_df['condition'] == 'stop').values
+                           .reshape(shape),
+                           data_df['goRT'].values.reshape(shape),
+                           data_df['stopRT'].values.reshape(shape),
+                           data_df['SSD'].values.reshape(shape))
+    for i, (_, sub_df) in enumerate(data_df.groupby('ID')):
+        SSRTs = SSRTmodel(model='all').fit_transform(sub_df)['SSRT']
+        for method, SSRT in SSRTs.items():
+            assert np.isclose(estimates[method][i], SSRT)
+
+
+def test_compare_SSRT_methods():
+    bias_df = compare_SSRT_methods(n_subjects=500, n_trials=400,
+                                   chunk_size=200, seed=0)
+    assert list(bias_df.index) == ['mean', 'integration', 'omission',
+                                   'replacement']
+    assert (bias_df['n'] == 500).all()
+    assert np.allclose(bias_df['RMSE'] ** 2,
+                       bias_df['bias'] ** 2 + bias_df['variance'])
+    assert (bias_df['bias'].abs() < 25).all()
+
+
+def test_exgauss_SSRT_is_recovered():
+    data_df, true_SSRTs = simulate_race(n_subjects=20, n_trials=400, seed=0,
+                                        omission_rate=0, SSRT_trial_sd=30,
+                                        return_SSRTs=True)
+    metrics = SSRTmodel(model='exgauss').fit_transform(data_df,
+                                                       level='group')
+    assert np.abs(metrics['SSRT'] - true_SSRTs).mean() < 20
+    assert np.isclose(metrics['go_sigma'].mean(), 50, rtol=.2)
+    assert np.isclose(metrics['go_tau'].mean(), 100, rtol=.2)
+    # subjects are fit the same way alone or in a batch
+    indiv_metrics = SSRTmodel(model='exgauss').fit_transform(
+        data_df[data_df['ID'] == 3])
+    for key in ['SSRT', 'SSRT_sd', 'go_mu', 'neg_log_likelihood']:
+        assert np.isclose(indiv_metrics[key], metrics.loc[3, key])
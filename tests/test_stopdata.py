@@ -0,0 +1,161 @@
+"""
+tests for standardizing raw data
+"""
+
+from stopsignalmetrics import StopData, SSRTmodel
+from stopsignalmetrics.base import JSON_DICT, CSV_DICT, _forget_validated
+from stopsignalmetrics.standards import get_standards
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_stream_matches_load():
+    full_df = StopData().load(source='mturk', level='group')
+    var_dict = json.load(open(JSON_DICT['mturk']))
+    parts = list(StopData(var_dict=var_dict).stream(
+        CSV_DICT['mturk']['group'], chunksize=500))
+    assert [sub_id for sub_id, _ in parts] == list(full_df['ID'].unique())
+    stream_df = pd.concat([sub_df for _, sub_df in parts])
+    assert np.array_equal(stream_df['goRT'].astype(float),
+                          full_df['goRT'].astype(float), equal_nan=True)
+
+
+def test_stream_keeps_missing_IDs(tmp_path):
+    var_dict = json.load(open(JSON_DICT['mturk']))
+    raw_df = pd.read_csv(CSV_DICT['mturk']['group'])
+    # row 498 is within the subject spanning the first chunk boundary
+    raw_df.loc[[0, 1, 498, 700], var_dict['columns']['ID']] = np.nan
+    raw_path = str(tmp_path / 'raw.csv')
+    raw_df.to_csv(raw_path, index=False)
+    full_df = StopData(var_dict=var_dict).load_csv(raw_path)
+    parts = list(StopData(var_dict=var_dict).stream(raw_path, chunksize=500))
+    assert sum(pd.isnull(sub_id) for sub_id, _ in parts) == 2
+    stream_df = pd.concat([sub_df for _, sub_df in parts])
+    assert len(stream_df) == len(full_df)
+    assert stream_df['ID'].isnull().sum() == 4
+    out_path = str(tmp_path / 'out.csv')
+    StopData(var_dict=var_dict).stream_to_csv(raw_path, out_path,
+                                              chunksize=500)
+    assert len(pd.read_csv(out_path)) == len(full_df)
+
+
+def test_non_numeric_RTs_and_SSDs_are_missing():
+    var_dict = json.load(open(JSON_DICT['mturk']))
+    raw_df = pd.read_csv(CSV_DICT['mturk']['group'])
+    expected_df = StopData(var_dict=var_dict).fit_transform(raw_df)
+    RT_col = var_dict['columns']['goRT']
+    go_rows = np.flatnonzero(expected_df['goRT'].notnull().values)[:2]
+    raw_df[RT_col] = raw_df[RT_col].astype(object)
+    raw_df.loc[go_rows, RT_col] = ['', 'NA']
+    data_df = StopData(var_dict=var_dict).fit_transform(raw_df)
+    assert data_df['goRT'].dtype == float
+    assert data_df.loc[go_rows, 'goRT'].isnull().all()
+    expected_df.loc[go_rows, 'goRT'] = np.nan
+    assert np.array_equal(data_df['goRT'], expected_df['goRT'],
+                          equal_nan=True)
+
+    SSD_col = var_dict['columns']['SSD']
+    stop_rows = np.flatnonzero(expected_df['SSD'].notnull().values)[:2]
+    raw_df[SSD_col] = raw_df[SSD_col].astype(object)
+    raw_df.loc[stop_rows, SSD_col] = ['', 'NA']
+    data_df = StopData(var_dict=var_dict).fit_transform(raw_df)
+    assert data_df['SSD'].dtype == float
+    expected_df.loc[stop_rows, 'SSD'] = np.nan
+    assert np.array_equal(data_df['SSD'], expected_df['SSD'],
+                          equal_nan=True)
+
+
+def test_cached_load(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    full_df = StopData().load(source='inlab', level='group')
+    first_df = StopData().load(source='inlab', level='group', cache=True,
+                               cache_dir=cache_dir)
+    cached_df = StopData().load(source='inlab', level='group', cache=True,
+                                cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(full_df, first_df)
+    pd.testing.assert_frame_equal(full_df, cached_df)
+
+
+def test_cache_eviction(tmp_path):
+    from stopsignalmetrics.cache import DataCache
+    data_cache = DataCache(str(tmp_path), max_bytes=1)
+    data_df = pd.DataFrame({'a': np.arange(10.), 'b': list('abcdeabcde')})
+    data_cache.put('first', data_df)
+    data_cache.put('second', data_df)
+    assert data_cache.get('first') is None
+    pd.testing.assert_frame_equal(data_cache.get('second'), data_df)
+
+
+def test_standard_dtypes():
+    data_df = StopData().load(source='mturk', level='group')
+    for col in ['goRT', 'stopRT', 'SSD']:
+        assert data_df[col].dtype == np.float64
+    assert set(data_df['condition'].dropna().unique()) <= {'go', 'stop'}
+    assert (data_df['goRT'] > 0).sum() == data_df['goRT'].notnull().sum()
+
+
+def test_standards_are_shared_and_read_only():
+    assert StopData()._cols is get_standards()['columns']
+    with pytest.raises(TypeError):
+        get_standards()['columns']['ID'] = 'subject'
+    var_dict = {'columns': {'ID': 'Subject'}}
+    StopData(var_dict=var_dict)
+    assert var_dict == {'columns': {'ID': 'Subject'}}
+
+
+def test_validation_is_remembered():
+    data_df = StopData().load(source='inlab', level='group')
+    assert SSRTmodel()._is_preprocessed(data_df)
+    data_df['choice_accuracy'] = np.where(data_df['choice_accuracy'] == 1,
+                                          1, 2)
+    with pytest.raises(AssertionError):
+        SSRTmodel()._is_preprocessed(data_df)
+    with pytest.raises(AssertionError):
+        SSRTmodel()._is_preprocessed(data_df.drop(columns='goRT'))
+    # in-place edits to a validated frame are caught
+    data_df = StopData().load(source='inlab', level='group')
+    assert SSRTmodel()._is_preprocessed(data_df)
+    data_df.loc[0, 'choice_accuracy'] = 'bogus'
+    with pytest.raises(AssertionError):
+        SSRTmodel()._is_preprocessed(data_df)
+    data_df = StopData().load(source='inlab', level='group')
+    assert SSRTmodel()._is_preprocessed(data_df)
+    data_df.loc[0, 'choice_accuracy'] = 5
+    _forget_validated(data_df)
+    with pytest.raises(AssertionError):
+        SSRTmodel()._is_preprocessed(data_df)
+
+
+def test_parquet_io(tmp_path):
+    pytest.importorskip('pyarrow')
+    from stopsignalmetrics.arrowio import write_parquet
+    raw_df = pd.read_csv(CSV_DICT['inlab']['group'])
+    var_dict = json.load(open(JSON_DICT['inlab']))
+    raw_path = str(tmp_path / 'raw.parquet')
+    write_parquet(raw_df, raw_path, row_group_size=2400)
+    full_df = StopData(var_dict=var_dict).fit_transform(raw_df)
+
+    # only the standard columns are read
+    data_df = StopData(var_dict=var_dict).load_parquet(raw_path)
+    assert set(data_df.columns) == set(get_standards()['columns'].values())
+    pd.testing.assert_frame_equal(data_df, full_df[data_df.columns])
+    sub_df = StopData(var_dict=var_dict).load_parquet(
+        raw_path, IDs=[2, 3], extra_columns=['GoTrialResponse'])
+    assert list(sub_df['ID'].unique()) == [2, 3]
+    assert 'GoTrialResponse' in sub_df.columns
+
+    # outputs round trip, and computers accept arrow tables
+    model = SSRTmodel().fit(data_df, level='group')
+    out_path = str(tmp_path / 'ssrt.parquet')
+    model.to_parquet(out_path)
+    pd.testing.assert_frame_equal(pd.read_parquet(out_path),
+                                  model.transform())
+    assert SSRTmodel().fit_transform(
+        StopData().fit(data_df).to_arrow(), level='group').equals(
+            model.transform())
+    indiv_path = str(tmp_path / 'indiv.parquet')
+    SSRTmodel(model='all').fit(data_df[data_df['ID'] == 1]).to_parquet(
+        indiv_path)
+    assert 'SSRT_replacement' in pd.read_parquet(indiv_path).columns